@@ -1,7 +1,11 @@
+import logging
 import re
 import shutil
+from functools import lru_cache
 from pathlib import Path
 
+from src.plugin.comm.metadata import Metadata
+
 
 def move(src: Path, dest: Path, flag: str = None):
     """
@@ -20,8 +24,7 @@ def move(src: Path, dest: Path, flag: str = None):
         # console.print(f"move {src.name} to {flag} folder")
         return dest
     except Exception as exc:
-        # console.print(f"fail to move file: {str(exc)}")
-        ...
+        logging.info(f"fail to move file: {str(exc)}")
 
 
 def mkdir(dest: Path):
@@ -37,12 +40,11 @@ def mkdir(dest: Path):
 
     """
     try:
-        dest.mkdir(exist_ok=True)
+        dest.mkdir(parents=True, exist_ok=True)
         # console.print(f"succeed create folder: {dest.as_posix()}")
         return dest
     except Exception as exc:
-        # console.print(f"fail to create folder: {str(exc)}")
-        ...
+        logging.info(f"fail to create folder: {str(exc)}")
 
 
 def create_folder(search_path: Path, folder: str):
@@ -60,24 +62,91 @@ def create_folder(search_path: Path, folder: str):
     return mkdir(folder)
 
 
-def replace_date(data, rule: str) -> str:
+class Template:
+    """
+    a naming rule compiled into segments of literal text and metadata fields
+    the longest field name matches first, so `original_title` is not read as `title`
+    the tags of extra_tag (part, sub, leaked) may be used as fields too
+    """
+
+    # rule name -> metadata field
+    aliases = {"number": "id"}
+    # read from data.extra
+    extra = ("part", "sub", "leaked")
+    _illegal = re.compile(r'[?%*:|"<>]')
+    _illegal_value = re.compile(r'[?%*:|"<>/\\]')
+
+    def __init__(self, rule: str):
+        names = [f for f in Metadata.fields if f != "provenance"] + list(self.aliases) + list(self.extra)
+        pattern = re.compile("|".join(sorted(map(re.escape, names), key=len, reverse=True)))
+        # each segment is a list of (is_field, text)
+        self.segments = []
+        for segment in rule.split("/"):
+            parts, pos = [], 0
+            for obj in pattern.finditer(segment):
+                if obj.start() > pos:
+                    parts.append((False, self._illegal.sub("_", segment[pos:obj.start()])))
+                parts.append((True, self.aliases.get(obj.group(), obj.group())))
+                pos = obj.end()
+            if pos < len(segment):
+                parts.append((False, self._illegal.sub("_", segment[pos:])))
+            self.segments.append(parts)
+        self.fields = frozenset(text for parts in self.segments for is_field, text in parts if is_field)
+
+    @classmethod
+    @lru_cache(maxsize=32)
+    def compile(cls, rule: str):
+        return cls(rule)
+
+    def _value(self, data, name) -> str:
+        value = data.extra.get(name) if name in self.extra else data.get(name)
+        if isinstance(value, (list, tuple)):
+            value = ",".join(v for v in value if isinstance(v, str))
+        if not isinstance(value, str):
+            return ""
+        return self._illegal_value.sub("_", value.strip())
+
+    @staticmethod
+    def truncate(text: str, max_len: int) -> str:
+        """
+        cut to max_len bytes of utf-8, without splitting a character
+        """
+        encoded = text.encode("utf-8")
+        if len(encoded) <= max_len:
+            return text
+        return encoded[:max_len].decode("utf-8", errors="ignore").rstrip()
+
+    def render(self, data, max_len: int = None) -> str:
+        """
+        Args:
+            data (Metadata):
+            max_len (int): bytes per path segment
+
+        Returns:
+            str: path, empty segments dropped
+        """
+        segments = []
+        for parts in self.segments:
+            segment = "".join(self._value(data, text) if is_field else text for is_field, text in parts)
+            if max_len:
+                segment = self.truncate(segment, max_len)
+            if segment.strip():
+                segments.append(segment)
+        return "/".join(segments)
+
+
+def replace_date(data, rule: str, max_len: int = None) -> str:
     """
     replace path or name with the metadata
     Args:
         rule (str): folder naming rule
         data (Metadata):
+        max_len (int): bytes per path segment, resource.name_max_len
 
     Returns:
         str: folder path
     """
-    # data name list that needs to be replaced
-
-    # method one: for
-    replaced = [i for i in data.keys() if i in rule and isinstance(data[i], str)]
-    for s in replaced:
-        rule = rule.replace(s, data[s].strip())
-    # Remove illegal characters
-    return re.sub(r'[?%*:|"<>]', "_", rule)
+    return Template.compile(rule).render(data, max_len)
 
 
 def check_data(data) -> bool:
@@ -108,11 +177,11 @@ def extra_tag(file: Path, data, config):
     if any(k in filename.lower() for k in config.leaked_suffix):
         data.extra.leaked = "Leaked"
 
-    if config.part_suffix in filename.lower():
-        searchobj = re.search(
-            r"^" + config.part_suffix + r"\d", filename, flags=re.I
-        )
-        data.extra.part = searchobj.group() if searchobj else ''
+    # eg. ABC-123-cd2.mp4, without resource.part_suffix cd, part and pt are recognized
+    suffix = re.escape(config.part_suffix) if config.part_suffix else r"[-_ .](?:cd|part|pt)"
+    searchobj = re.search(suffix + r"\d+$", file.stem, flags=re.I)
+    if searchobj:
+        data.extra.part = searchobj.group()
 
     if any(k in filename.lower() for k in config.sub_suffix):
         data.extra.sub = "C"
@@ -16,6 +16,13 @@ class Comm:
     enable_translate: bool = False
     translate_target: str = "zh-cn"
     priority: list = field(default_factory=list)
+    race: int = 0
+    race_grace: float = 1.0
+    merge: bool = False
+    field_priority: dict = field(default_factory=dict)
+    parse_workers: int = 0
+    parse_backlog: int = 64
+    queue_size: int = 64
     cookie: dict = field(default_factory=dict)
 
     def __post_init__(self):
@@ -30,6 +37,8 @@ class Resource:
     name_rule_file: str = "number-title"
     name_max_len: int = 50
     part_suffix: str = ""
+    incremental: bool = False
+    move_workers: int = 4
 
     file_type: list = field(default_factory=list)
     exclude_folders: list = field(default_factory=list)
@@ -61,7 +70,38 @@ class Network:
     proxy_host: str = ""
     timeout: int = 5
     total: int = 3
-    delay: int = 1
+    delay: float = 1.0
+    site_delay: dict = field(default_factory=dict)
+    pool_connections: int = 10
+    pool_maxsize: int = 10
+    concurrency: int = 16
+    site_concurrency: int = 4
+    download_workers: int = 4
+
+
+@dataclass
+class Cache:
+    enable: bool = False
+    path: str = "cache"
+    ttl: int = 7 * 24 * 3600
+    site_ttl: dict = field(default_factory=dict)
+    max_size: int = 512 * 1024 * 1024
+    offline: bool = False
+    enable_store: bool = False
+    store_ttl: int = 30 * 24 * 3600
+    failed_backoff: int = 3600
+    link_ttl: int = 30 * 24 * 3600
+
+
+@dataclass
+class Trace:
+    enable: bool = False
+    # json lines of every span, empty to disable
+    jsonl: str = ""
+    # log percentiles per stage and site at exit
+    summary: bool = True
+    # prometheus textfile, empty to disable
+    prometheus: str = ""
 
 
 @dataclass
@@ -74,6 +114,8 @@ class Config:
     comm: Comm = field(default_factory=Comm)
     resource: Resource = field(default_factory=Resource)
     network: Network = field(default_factory=Network)
+    cache: Cache = field(default_factory=Cache)
+    trace: Trace = field(default_factory=Trace)
     debug: Debug = field(default_factory=Debug)
 
     def default_config(self):
@@ -110,9 +152,12 @@ class Config:
         for k, v in val.items():
             if k in self._fields(sub_attr):
                 old = getattr(sub_attr, k)
-                if type(old) != type(k):
+                # yaml reads 2 as int, a float setting takes it
+                if type(old) is float and type(v) is int:
+                    v = float(v)
+                elif type(old) != type(v):
                     raise ValueError
-                setattr(sub_attr, old, v)
+                setattr(sub_attr, k, v)
 
     @staticmethod
     def _fields(root):
@@ -1,39 +1,304 @@
 # coding: utf-8
 
 
-__all__ = ["search_video"]
+__all__ = [
+    "search_video", "query", "get_metadata", "merge_metadata", "race",
+    "get_metadata_async", "resolve_all", "resolve", "resolve_async",
+]
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from src.core.comm import check_data, extra_tag
-from src.core.init import PriorityQueue
+from src.core.init import ExtractNumber, PriorityQueue, Router
+from src.core.merge import fetch_all, merge
+from src.core.scanner import Scanner
+from src.core.store import ResultStore
+from src.plugin.comm.crawler import AsyncLimiter, SessionPool
+from src.plugin.comm.flight import SingleFlight
+from src.plugin.comm.registry import Registry
+
+# (number, settings) -> untagged result of this process, oldest dropped first,
+# misses are not kept, the store backs off failed numbers
+_resolved = OrderedDict()
+_resolved_lock = threading.Lock()
+_resolved_max = 4096
+_flight = SingleFlight()
 
 
 def search_video(path, cfg):
     """
     search video according to file type and exclude folder
-    Returns: file path list
+    with resource.incremental, only files new or changed since the last run
+
+    a file is recorded as handled once the caller asks for the next one,
+    a file yielded when the generator is closed or the caller fails is not,
+    so it is yielded again next run;
+    use Scanner(defer=True) and done() directly to record files selectively, see Pipeline
+    Yields: file path
+
+    """
+    scanner = Scanner.from_config(path, cfg, defer=True)
+    try:
+        for file in scanner:
+            yield file
+            scanner.done(file)
+    finally:
+        scanner.close()
+
+
+def query(website, number, cfg, **kwargs):
+    """
+    run one plugin, its hit and latency are recorded to rank plugins of later numbers
 
+    Returns:
+        Metadata: None if the plugin failed
     """
-    file_type = cfg.resource.file_type
-    excluded = [path.joinpath(e) for e in cfg.resource.exclude_folders]
-    files = []
-    for file in path.rglob("*"):
-        exs = [n for n in excluded if n in file.parents]
-        if not exs and file.suffix.lower() in file_type:
-            files.append(file)
-    return files
+    start = time.perf_counter()
+    data = None
+    try:
+        data = Registry.get(website, number, cfg, **kwargs)
+        return data
+    finally:
+        Router.default(cfg).record(
+            website, data is not None and check_data(data), time.perf_counter() - start
+        )
 
 
 def get_metadata(file, number, cfg):
     """
     get metadata from plugin according to number
 
+    files sharing a number (parts, subbed or leaked variants) are crawled once:
+    concurrent lookups wait for the one in flight, later ones reuse its result
+    if it succeeded, extra_tag is applied to a copy per file
+
     have been tested
     """
+    key = (number.strip().upper(), _settings(cfg))
+    with _resolved_lock:
+        data = _resolved.get(key)
+    if data is None:
+        data = _flight.do(key, _remember, key, number, cfg)
+    if data is None:
+        return
+    return extra_tag(file, data.copy(), cfg.resource)
+
+
+def _settings(cfg) -> tuple:
+    """
+    settings that change the result of resolve
+    """
+    comm, cache = cfg.comm, cfg.cache
+    field_priority = tuple(sorted((k, tuple(v)) for k, v in comm.field_priority.items()))
+    return (
+        tuple(comm.priority), comm.merge, comm.race, field_priority,
+        cache.enable_store, cache.path, cache.store_ttl, cache.failed_backoff,
+    )
+
+
+def _remember(key, number, cfg):
+    data = resolve(number, cfg)
+    if data is not None:
+        with _resolved_lock:
+            _resolved[key] = data
+            if len(_resolved) > _resolved_max:
+                _resolved.popitem(last=False)
+    return data
+
+
+def resolve(number, cfg):
+    """
+    crawl one number, without the tags of any file
+
+    Returns:
+        Metadata: None if every plugin failed
+    """
+    # numbers resolved or failed in earlier runs
+    store = ResultStore.default(cfg)
+    if store is not None:
+        if (data := store.get(number)) is not None:
+            return data
+        if store.failed(number):
+            return
     # priority init， get sorted plugin
-    priority = PriorityQueue.get(number, cfg.comm.priority)
+    priority = PriorityQueue.get(number, cfg.comm.priority, Router.default(cfg))
+    # every plugin reuses the same keep-alive connections
+    pool = SessionPool.default(cfg)
+    if cfg.comm.merge:
+        return _merge(number, priority, cfg, store, pool=pool)
+    while not priority.empty():
+        if cfg.comm.race > 1:
+            # the next top-n plugins at once
+            websites = [priority.pop().capitalize() for _ in range(cfg.comm.race) if not priority.empty()]
+            website, data = race(websites, number, cfg, pool=pool)
+        else:
+            website = priority.pop().capitalize()
+            data = query(website, number, cfg, pool=pool)
+        if data is not None and check_data(data):
+            if store is not None:
+                store.put(number, data, website)
+            return data
+    if store is not None:
+        store.put_failed(number)
+
+
+def merge_metadata(file, number, priority, cfg, store=None, **kwargs):
+    """
+    query all plugins at once and fill each field from the highest priority one that has it,
+    comm.field_priority may prefer other plugins per field
+
+    Returns:
+        Metadata: data.provenance records the plugin of each field
+    """
+    data = _merge(number, priority, cfg, store, **kwargs)
+    if data is not None:
+        return extra_tag(file, data, cfg.resource)
+
+
+def _merge(number, priority, cfg, store=None, **kwargs):
+    websites = []
+    while not priority.empty():
+        websites.append(priority.pop().capitalize())
+    results = fetch_all(websites, number, cfg, fn=query, **kwargs)
+    # fields follow the configured order, not the router's ranking of this run
+    order = [w.capitalize() for w in cfg.comm.priority]
+    data = merge(results, order, cfg.comm.field_priority)
+    if check_data(data):
+        if store is not None:
+            store.put(number, data, data.provenance["title"])
+        return data
+    if store is not None:
+        store.put_failed(number)
+
+
+def race(websites, number, cfg, **kwargs):
+    """
+    query plugins concurrently, the first result passing check_data wins,
+    unless a higher priority plugin still running answers within comm.race_grace seconds
+    losers not started yet are cancelled, running ones are left to finish and ignored
+
+    Args:
+        websites (list): plugin names, highest priority first
+
+    Returns:
+        tuple: (website, data), (None, None) if none passed
+    """
+    executor = ThreadPoolExecutor(max_workers=len(websites))
+    futures = {
+        executor.submit(query, w, number, cfg, **kwargs): i for i, w in enumerate(websites)
+    }
+    pending, best, results, deadline = set(futures), None, {}, None
+    try:
+        while pending:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures[future]
+                # noinspection PyBroadException
+                try:
+                    data = future.result()
+                except Exception as exc:
+                    logging.info(f"PluginError: {websites[index]} {exc}")
+                    continue
+                if data is not None and check_data(data) and (best is None or index < best):
+                    best, results[index] = index, data
+            if best is None:
+                continue
+            if all(futures[f] > best for f in pending):
+                break
+            if deadline is None:
+                deadline = time.monotonic() + cfg.comm.race_grace
+            elif time.monotonic() >= deadline:
+                break
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+    if best is None:
+        return None, None
+    return websites[best], results[best]
+
+
+async def get_metadata_async(file, number, cfg, limiter):
+    """
+    async version of get_metadata, plugins are still tried in priority order
+
+    Args:
+        limiter (AsyncLimiter): shared by all files of one batch
+    """
+    data = await resolve_async(number, cfg, limiter)
+    if data is not None:
+        return extra_tag(file, data, cfg.resource)
+
+
+async def resolve_async(number, cfg, limiter):
+    """
+    async version of resolve
+    """
+    store = ResultStore.default(cfg)
+    if store is not None:
+        if (data := store.get(number)) is not None:
+            return data
+        if store.failed(number):
+            return
+    priority = PriorityQueue.get(number, cfg.comm.priority, Router.default(cfg))
+    pool = SessionPool.default(cfg)
     while not priority.empty():
-        # noinspection PyBroadException
         website = priority.pop().capitalize()
-        data = Registry.get(website, number, cfg)
+        data = await limiter.run(website, query, website, number, cfg, pool=pool)
         if check_data(data):
-            return extra_tag(file, data, cfg.resource)
+            if store is not None:
+                store.put(number, data, website)
+            return data
+    if store is not None:
+        store.put_failed(number)
+
+
+async def resolve_all(files, cfg, extract=None):
+    """
+    resolve a list from search_video concurrently
+    bounded by network.concurrency in total and network.site_concurrency per plugin,
+    files sharing a number wait on one crawl
+
+    Args:
+        files (list): video paths
+        extract (ExtractNumber): number extractor
+
+    Yields:
+        tuple: (file, metadata or None), in completion order
+    """
+    extract = ExtractNumber() if extract is None else extract
+    limiter = AsyncLimiter.from_config(cfg)
+    crawls = {}
+
+    async def resolve(file):
+        # one failing file must not end the batch
+        # noinspection PyBroadException
+        try:
+            number = extract(file)
+            if number is None:
+                return file, None
+            key = number.strip().upper()
+            if key not in crawls:
+                crawls[key] = asyncio.ensure_future(resolve_async(number, cfg, limiter))
+            data = await asyncio.shield(crawls[key])
+            if data is None:
+                return file, None
+            return file, extra_tag(file, data.copy(), cfg.resource)
+        except Exception as exc:
+            logging.info(f"ResolveError: {file} {exc}")
+            return file, None
+
+    tasks = [asyncio.ensure_future(resolve(f)) for f in files]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks + list(crawls.values()):
+            task.cancel()
+        limiter.close()
@@ -4,53 +4,61 @@ this file contains components with preprocessing
 
 """
 
+import atexit
+import heapq
 import itertools
+import json
 import re
-from bisect import insort
+import threading
+from functools import lru_cache
+from pathlib import Path
 
 
-__all__ = ["PriorityQueue", "ExtractNumber"]
+__all__ = ["PriorityQueue", "Router", "ExtractNumber"]
 
 
 class PriorityQueue:
     """
-    Easy priority queue implemented by Insort
+    Priority queue implemented by heapq
+    re-prioritized tasks are marked removed and skipped when popped
 
     """
 
+    _removed = "<removed>"
+
     def __init__(self):
         self._pq = []
         self._entry_map = {}
         self._counter = itertools.count()
-        self.priority = lambda p: -int(p or 0)
+        self.priority = lambda p: -float(p or 0)
 
     def add(self, task, priority=None):
         """
         add task according priority
-        del old entry from pq if task in map
+        mark old entry as removed if task in map
         Args:
             task (str): plugin name, corresponding to crawler class
-            priority (int): usually 0 and 1
+            priority (float): higher first, same priority in insertion order
         """
         if task in self._entry_map:
-            old_entry = self._entry_map.pop(task)
-            self._pq.remove(old_entry)
+            self._entry_map.pop(task)[-1] = self._removed
         # queue consists of list form
         entry = [self.priority(priority), next(self._counter), task]
         self._entry_map[task] = entry
-        insort(self._pq, entry)
+        heapq.heappush(self._pq, entry)
 
     def pop(self):
         """
         shift and return value
 
-        Returns: the last value in the queue
+        Returns: the task with highest priority, None if empty
 
         """
-        try:
-            return self._pq.pop(0)[-1]
-        except IndexError:
-            pass
+        while self._pq:
+            task = heapq.heappop(self._pq)[-1]
+            if task is not self._removed:
+                del self._entry_map[task]
+                return task
 
     def empty(self):
         """
@@ -60,120 +68,259 @@ class PriorityQueue:
             bool: false if empty
 
         """
-        return bool(not self._pq)
+        return not self._entry_map
+
+    def __len__(self):
+        return len(self._entry_map)
 
     @classmethod
-    def get(cls, n: str, website: list):
+    def get(cls, n: str, website: list, router=None):
         """
         init plugin priority, adjust according to number
         Args:
             n (str): id
             website (list): plugin name
+            router (Router): ranks the plugins, the process-wide one if not given
 
         Returns: priorities obj
 
         """
+        router = Router.default() if router is None else router
         pq = cls()
         for w in website:
-            pq.add(w, 0)
-        # if re.match(r"^\d{5,}", n) or "heyzo" in n.lower():
-        #     pq.add("avsox", 1)
-        # elif re.match(r"\d+[a-zA-Z]+-\d+", number) or "siro" in number.lower():
-        # cls.add("mgstage", 1)
-        # elif (re.match(r"\D{2,}00\d{3,}", number) and "-" not in number
-        #       and "_" not in number):
-        #     cls.add("dmm", 1)
-        # elif re.search(r"\D+\.\d{2}\.\d{2}\.\d{2}", number):
-        #     cls.add("javdb", 1)
-        # elif "fc2" in number.lower():
-        #     cls.add("fc2", 1)
-        # elif "rj" in number.lower():
-        #     cls.add("dlsite", 1)
-
+            pq.add(w, router.score(n, w))
         return pq
 
 
+class Router:
+    """
+    rank plugins for a number
+    from number patterns (a plugin known to host the format goes first)
+    and from the recorded hit rate and latency of each plugin
+
+    """
+
+    # cache path, None when not persisted -> router, see default()
+    _defaults = {}
+    _lock = threading.Lock()
+
+    # pattern, plugin that hosts numbers of this format
+    rules = [
+        (re.compile(r"^\d{5,}|heyzo", re.I), "avsox"),
+        (re.compile(r"^\d+[a-z]+-\d+|siro", re.I), "mgstage"),
+        (re.compile(r"^(?!.*[-_])\D{2,}00\d{3,}"), "dmm"),
+        (re.compile(r"\D+\.\d{2}\.\d{2}\.\d{2}"), "javdb"),
+        (re.compile(r"fc2", re.I), "fc2"),
+        (re.compile(r"rj", re.I), "dlsite"),
+    ]
+
+    def __init__(self, latency_weight: float = 0.1):
+        """
+        Args:
+            latency_weight (float): score lost per second of average latency
+        """
+        self.latency_weight = latency_weight
+        self._stats = {}
+        self._lock = threading.Lock()
+        # where the stats are kept between runs, see default()
+        self.file = None
+
+    @classmethod
+    def default(cls, config=None):
+        """
+        process-wide router, one per cache path, with cache.enable
+        stats of earlier runs are loaded from cache.path/router.json and saved back at exit,
+        without config or cache the router only lives in memory
+        """
+        key = None
+        if config is not None and config.cache.enable:
+            key = config.cache.path
+        with cls._lock:
+            if key not in cls._defaults:
+                router = cls._defaults[key] = cls()
+                if key is not None:
+                    router.file = Path(key).joinpath("router.json")
+                    router.load(router.file)
+                    atexit.register(router.save, router.file)
+            return cls._defaults[key]
+
+    def score(self, number: str, website: str) -> float:
+        """
+        a matching pattern rule outweighs any learned score,
+        unseen plugins score the same, so the configured order is kept
+
+        Returns:
+            float: higher first
+        """
+        website = website.lower()
+        boost = sum(1 for r, w in self.rules if w == website and r.search(number))
+        with self._lock:
+            hits, attempts, latency = self._stats.get(website, (0, 0, 0.0))
+        # smoothed hit rate, 0.5 for an unseen plugin
+        rate = (hits + 1) / (attempts + 2)
+        return boost + rate - 0.5 - self.latency_weight * latency
+
+    def record(self, website: str, hit: bool, elapsed: float):
+        """
+        record one lookup, latency as exponential moving average
+        """
+        website = website.lower()
+        with self._lock:
+            hits, attempts, latency = self._stats.get(website, (0, 0, 0.0))
+            latency = elapsed if not attempts else 0.8 * latency + 0.2 * elapsed
+            self._stats[website] = (hits + bool(hit), attempts + 1, latency)
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                w: {"hits": h, "attempts": a, "latency": lat} for w, (h, a, lat) in self._stats.items()
+            }
+
+    def save(self, file: Path):
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(json.dumps(self.stats))
+
+    def load(self, file: Path):
+        """
+        restore stats saved by an earlier run
+        """
+        if file.exists():
+            with self._lock:
+                for w, s in json.loads(file.read_text()).items():
+                    self._stats[w] = (s["hits"], s["attempts"], s["latency"])
+
+
 class ExtractNumber:
+    """
+    Extract the number from a file name
+    rules are compiled once and tried in order, the first match wins,
+    results are cached per file stem
+    """
+
     _banned = [
         r"cd\d$", "1080p", "1pon", ".com", "nyap2p", "22-sht.me", "xxx", "carib"
     ]
 
-    def banned(self, name, banned=None):
-        banned = self._banned if banned is None else set(banned + self._banned)
-        pattern = re.compile(r"\b(" + "|".join(banned) + ")\\W", re.I)
-        return pattern.sub("", name).rstrip("-cC")
+    _west = re.compile(r"^\D+\d{2}\.\d{2}\.\d{2}")
+    _west_title = re.compile(r"^\D+\d{2}\.\d{2}\.\d{2}\.\D+", re.I)
+    _xxxav = re.compile(r"XXX-AV-\d{4,}", re.I)
+    _tokyohot = re.compile(r"n[1|0]\d{3}", re.I)
+    _luxu = re.compile(r"\d{0,3}luxu[-_]\d{4}", re.I)
+    _fc2_like = re.compile(r"fc.*?\d{5,}", re.I)
+    _fc2_ppv_line = re.compile(r"ppv\s*[-|_]\s*\d{6,}", re.I)
+    _fc2_ppv = re.compile(r"ppv", re.I)
+    _fc2_ppv_space = re.compile(r"\s{0,2}ppv\s{0,2}", re.I)
+    _fc2_short = re.compile(r"fc[^2]\d{5,}", re.I)
+    _fc2 = re.compile(r"fc2[-_]\d{6,}", re.I)
+    _regular = [
+        re.compile(r"[a-z]{2,5}[-_]\d{2,4}", re.I),  # bf-123 abp-454 mkbd-120  kmhrs-026
+        re.compile(r"[a-z]{4}[-_][a-z]\d{3}", re.I),  # mkbd-s120
+        re.compile(r"\d{6,}[-_][a-z]{4,}", re.I),  # 111111-MMMM
+        re.compile(r"\d{6,}[-_]\d{3,}", re.I),  # 111111-111
+        re.compile(r"n[-_]*[1|0]\d{3}", re.I),  # n1111,n-1111
+    ]
+    _no_line = [
+        re.compile(r"([a-z]{2,5})(\d{2,3})", re.I),  # bf123 abp454 mkbd120  kmhrs026
+        re.compile(r"(\d{6,})([a-z]{4,})", re.I),  # 111111MMMM
+    ]
 
     @staticmethod
-    def west(name):
-        if obj := re.search(r"^\D+\d{2}\.\d{2}\.\d{2}", name):
-            if sec_obj := re.search(
-                    r"^\D+\d{2}\.\d{2}\.\d{2}\.\D+", name, flags=re.I
-            ):
+    @lru_cache(maxsize=64)
+    def _banned_pattern(banned: tuple):
+        return re.compile(r"\b(" + "|".join(banned) + ")\\W", re.I)
+
+    @classmethod
+    def banned(cls, name, banned=None):
+        banned = cls._banned if banned is None else dict.fromkeys(banned + cls._banned)
+        return cls._banned_pattern(tuple(banned)).sub("", name).rstrip("-cC")
+
+    @classmethod
+    def west(cls, name):
+        if obj := cls._west.search(name):
+            if sec_obj := cls._west_title.search(name):
                 return sec_obj.group()
             return obj.group()
 
-    @staticmethod
-    def xxxav(name):
-        if obj := re.search(r"XXX-AV-\d{4,}", name.upper(), flags=re.I):
+    @classmethod
+    def xxxav(cls, name):
+        if obj := cls._xxxav.search(name.upper()):
             return obj.group()
 
-    @staticmethod
-    def tokyohot(name):
-        if obj := re.search(r"n[1|0]\d{3}", name, flags=re.I):
+    @classmethod
+    def tokyohot(cls, name):
+        if obj := cls._tokyohot.search(name):
             return obj.group()
 
-    @staticmethod
-    def luxu(name):
-        if obj := re.search(r"\d{0,3}luxu[-_]\d{4}", name, re.I):
+    @classmethod
+    def luxu(cls, name):
+        if obj := cls._luxu.search(name):
             return obj.group()
 
-    @staticmethod
-    def fc2(name):
+    @classmethod
+    def fc2(cls, name):
         if "ppv" in name.lower():
             # if has line, del ppv
-            if re.search(r"ppv\s*[-|_]\s*\d{6,}", name, flags=re.I):
-                name = re.sub(r"ppv", "", name, flags=re.I)
+            if cls._fc2_ppv_line.search(name):
+                name = cls._fc2_ppv.sub("", name)
             # if no line, replace ppv with line
-            name = re.sub(
-                r"\s{0,2}ppv\s{0,2}", "-", name, flags=re.I
-            )
+            name = cls._fc2_ppv_space.sub("-", name)
         # if fcxxxx, replace fc with fc2-
-        if re.search(r"fc[^2]\d{5,}", name, re.I):
+        if cls._fc2_short.search(name):
             name = name.replace("fc", "fc2-").replace("FC", "FC2-")
-        if obj := re.search(r"fc2[-_]\d{6,}", name, flags=re.I):
+        if obj := cls._fc2.search(name):
             return obj.group()
 
-    @staticmethod
-    def regular(name):
-        regex = [
-            r"[a-z]{2,5}[-_]\d{2,4}",  # bf-123 abp-454 mkbd-120  kmhrs-026
-            r"[a-z]{4}[-_][a-z]\d{3}",  # mkbd-s120
-            r"\d{6,}[-_][a-z]{4,}",  # 111111-MMMM
-            r"\d{6,}[-_]\d{3,}",  # 111111-111
-            r"n[-_]*[1|0]\d{3}",  # n1111,n-1111
-        ]
-        for r in regex:
-            if searchobj := re.search(r, name, flags=re.I):
+    @classmethod
+    def regular(cls, name):
+        for r in cls._regular:
+            if searchobj := r.search(name):
                 return searchobj.group()
 
-    @staticmethod
-    def no_line(name):
-        regex = [
-            r"([a-z]{2,5})(\d{2,3})",  # bf123 abp454 mkbd120  kmhrs026
-            r"(\d{6,})([a-z]{4,})",  # 111111MMMM
-        ]
-        for r in regex:
-            if obj := re.search(r, name, flags=re.I):
+    @classmethod
+    def no_line(cls, name):
+        for r in cls._no_line:
+            if obj := r.search(name):
                 return obj.group(1) + "-" + obj.group(2)
 
-    def __call__(self, name, *args, **kwargs):
-        name = self.banned(name.stem, *args, **kwargs)
-        funcs = [self.west(name), self.xxxav(name), self.tokyohot(name), self.luxu(name)]
-        for func in funcs:
-            if func is not None:
-                return func
-        if re.search(r'fc.*?\d{5,}', name, flags=re.I):
-            return self.fc2(name)
+    @classmethod
+    def extract(cls, name: str):
+        """
+        extract from a cleaned name, rules in order, short-circuit on first match
+        """
+        for rule in (cls.west, cls.xxxav, cls.tokyohot, cls.luxu):
+            if (number := rule(name)) is not None:
+                return number
+        if cls._fc2_like.search(name):
+            return cls.fc2(name)
         if "-" in name or "_" in name:
-            return self.regular(name)
-        return self.no_line(name)
+            return cls.regular(name)
+        return cls.no_line(name)
+
+    @classmethod
+    @lru_cache(maxsize=65536)
+    def _cached(cls, stem: str, banned: tuple = None):
+        return cls.extract(cls.banned(stem, None if banned is None else list(banned)))
+
+    def __call__(self, name, banned=None):
+        """
+        Args:
+            name (Path): file path
+            banned (list): extra words to remove before extracting
+
+        Returns:
+            str: number, None if not found
+        """
+        return self._cached(name.stem, None if banned is None else tuple(banned))
+
+    def batch(self, names, banned=None) -> list:
+        """
+        extract numbers of many files
+
+        Args:
+            names (iterable): file paths
+
+        Returns:
+            list: (path, number) pairs
+        """
+        return [(name, self(name, banned)) for name in names]
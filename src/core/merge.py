@@ -0,0 +1,75 @@
+# coding: utf-8
+"""
+field level merging of metadata from several plugins
+
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from src.plugin.comm.metadata import Metadata
+from src.plugin.comm.registry import Registry
+
+__all__ = ["fetch_all", "merge"]
+
+# not filled from a single field of a plugin
+_skipped = {"extra", "provenance"}
+
+
+def fetch_all(websites, number, cfg, fn=Registry.get, **kwargs) -> dict:
+    """
+    query plugins concurrently
+
+    Args:
+        websites (list): plugin names
+        fn (callable): called as fn(website, number, cfg, **kwargs)
+
+    Returns:
+        dict: website -> data, failed plugins left out
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(len(websites), 1)) as executor:
+        futures = {w: executor.submit(fn, w, number, cfg, **kwargs) for w in websites}
+        for website, future in futures.items():
+            # noinspection PyBroadException
+            try:
+                data = future.result()
+            except Exception as exc:
+                logging.info(f"PluginError: {website} {exc}")
+                continue
+            if data is not None:
+                results[website] = data
+    return results
+
+
+def _filled(value) -> bool:
+    return value not in (None, "", "null", [], {})
+
+
+def merge(results: dict, priority: list, field_priority: dict = None):
+    """
+    fill each field from the highest priority plugin that has it
+
+    Args:
+        results (dict): website -> data
+        priority (list): website names, highest first
+        field_priority (dict): field -> website names tried before the default priority
+
+    Returns:
+        Metadata: with provenance, field -> website it came from
+    """
+    field_priority = field_priority or {}
+    data = Metadata()
+    provenance = {}
+    fields = dict.fromkeys(k for w in priority if w in results for k in results[w])
+    for key in fields:
+        if key in _skipped:
+            continue
+        preferred = [w.capitalize() for w in field_priority.get(key, [])]
+        for website in preferred + [w for w in priority if w not in preferred]:
+            value = results.get(website, {}).get(key)
+            if _filled(value):
+                data[key] = value
+                provenance[key] = website
+                break
+    data.provenance = provenance
+    return data
@@ -0,0 +1,208 @@
+# coding: utf-8
+"""
+batch file organizer: plan all moves first, then execute them
+
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from src.core.comm import Template, replace_date
+from src.plugin.comm.trace import Tracer
+
+__all__ = ["Planner", "Plan", "Journal"]
+
+
+@dataclass
+class Plan:
+    moves: list = field(default_factory=list)
+    # (src, dest, reason) of moves that would overwrite something
+    collisions: list = field(default_factory=list)
+
+
+class Journal:
+    """
+    json lines of completed moves, enough to undo them
+    """
+
+    def __init__(self, file: Path):
+        self.file = file
+        self._lock = threading.Lock()
+        self._out = None
+
+    def record(self, src: Path, dest: Path):
+        with self._lock:
+            if self._out is None:
+                self.file.parent.mkdir(parents=True, exist_ok=True)
+                self._out = self.file.open("a", encoding="utf-8")
+            self._out.write(json.dumps({"src": str(src), "dest": str(dest)}, ensure_ascii=False) + "\n")
+            self._out.flush()
+
+    def close(self):
+        with self._lock:
+            if self._out is not None:
+                self._out.close()
+                self._out = None
+
+    def rollback(self) -> int:
+        """
+        move every journaled file back, latest first
+
+        Returns:
+            int: files moved back
+        """
+        self.close()
+        if not self.file.exists():
+            return 0
+        with self.file.open(encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        restored = 0
+        for entry in reversed(entries):
+            src, dest = Path(entry["src"]), Path(entry["dest"])
+            if not dest.exists() or src.exists():
+                continue
+            try:
+                src.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(dest), str(src))
+                restored += 1
+            except OSError as exc:
+                logging.info(f"fail to roll back {dest}: {exc}")
+        return restored
+
+
+class Planner:
+    """
+    compute target paths of all resolved titles with the naming rules,
+    detect collisions before touching anything,
+    create each folder once, rename on the same device
+    and copy across devices in a bounded pool
+    """
+
+    def __init__(self, root: Path, cfg, journal: Journal = None):
+        """
+        Args:
+            root (Path): library folder
+            cfg (Config):
+            journal (Journal): records moves, a new one under cache.path if not given
+        """
+        self.root = root
+        self.cfg = cfg
+        self.workers = cfg.resource.move_workers
+        if journal is None:
+            name = time.strftime("journal-%Y%m%d-%H%M%S.jsonl")
+            journal = Journal(Path(cfg.cache.path).joinpath(name))
+        self.journal = journal
+
+    def target(self, file: Path, data):
+        """
+        Args:
+            data (Metadata): None if not resolved
+
+        Returns:
+            Path: target path, None if the file stays
+        """
+        res = self.cfg.resource
+        if data is None:
+            if not self.cfg.comm.failed_move:
+                return
+            return self.root.joinpath(res.failed_folder, file.name)
+        folder = self.root.joinpath(
+            res.success_folder, replace_date(data, res.name_rule_folder, res.name_max_len)
+        )
+        name = replace_date(data, res.name_rule_file, res.name_max_len) or file.stem
+        # parts of one title would share the target unless the rule names them
+        if data.extra.part and "part" not in Template.compile(res.name_rule_file).fields:
+            name += data.extra.part
+        return folder.joinpath(name + file.suffix)
+
+    def plan(self, items) -> Plan:
+        """
+        Args:
+            items (iterable): (file, data) pairs
+
+        Returns:
+            Plan: moves to run and collisions left out
+        """
+        plan = Plan()
+        claimed = {}
+        for file, data in items:
+            dest = self.target(file, data)
+            if dest is None or dest == file:
+                continue
+            key = os.path.normcase(str(dest))
+            if key in claimed:
+                plan.collisions.append((file, dest, f"same target as {claimed[key]}"))
+            elif dest.exists():
+                plan.collisions.append((file, dest, "target exists"))
+            else:
+                claimed[key] = file
+                plan.moves.append((file, dest))
+        return plan
+
+    @staticmethod
+    def same_device(src: Path, dest: Path) -> bool:
+        try:
+            return os.stat(src).st_dev == os.stat(dest.parent).st_dev
+        except OSError:
+            return False
+
+    def move(self, src: Path, dest: Path) -> bool:
+        """
+        rename if on the same device, else copy to a temp file, rename it and delete the source
+        """
+        span = Tracer.default(self.cfg).span("move")
+        try:
+            with span:
+                if self.same_device(src, dest):
+                    span.set(kind="rename")
+                    os.rename(src, dest)
+                else:
+                    span.set(kind="copy")
+                    part = dest.with_name(dest.name + ".part")
+                    shutil.copy2(src, part)
+                    os.replace(part, dest)
+                    os.unlink(src)
+        except OSError as exc:
+            logging.info(f"fail to move {src}: {exc}")
+            return False
+        self.journal.record(src, dest)
+        return True
+
+    def execute(self, plan: Plan, progress=None) -> dict:
+        """
+        Args:
+            plan (Plan):
+            progress (callable): called as progress(done, total) after each move
+
+        Returns:
+            dict: count of moved and failed files
+        """
+        counts = {"moved": 0, "failed": 0}
+        total, lock = len(plan.moves), threading.Lock()
+
+        def run(move):
+            ok = self.move(*move)
+            with lock:
+                counts["moved" if ok else "failed"] += 1
+                if progress is not None:
+                    progress(counts["moved"] + counts["failed"], total)
+
+        folders = {dest.parent for _, dest in plan.moves}
+        for folder in folders:
+            folder.mkdir(parents=True, exist_ok=True)
+        same, cross = [], []
+        for src, dest in plan.moves:
+            (same if self.same_device(src, dest) else cross).append((src, dest))
+        # renames are metadata only, copies run in parallel
+        for move in same:
+            run(move)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(run, cross))
+        self.journal.close()
+        return counts
@@ -0,0 +1,162 @@
+# coding: utf-8
+"""
+streaming pipeline: scan -> extract number -> fetch metadata -> organize
+stages run concurrently and are connected by bounded queues,
+so memory stays flat and finished titles are organized while the scan is still running
+
+"""
+import json
+import logging
+import queue
+import threading
+from pathlib import Path
+
+from src.core.comm import mkdir
+from src.core.defaults import get_metadata
+from src.core.init import ExtractNumber
+from src.core.organize import Planner
+from src.core.scanner import Scanner
+from src.plugin.comm.trace import Tracer
+
+__all__ = ["Pipeline"]
+
+_done = object()
+
+
+class Pipeline:
+    """
+    every handled file is appended to a checkpoint,
+    a run started again after a crash skips the files already handled
+    the checkpoint is removed once a run completes
+    """
+
+    def __init__(self, root: Path, cfg, extract: ExtractNumber = None):
+        """
+        Args:
+            root (Path): library folder
+            cfg (Config):
+            extract (ExtractNumber): number extractor
+        """
+        self.root = root
+        self.cfg = cfg
+        self.extract = ExtractNumber() if extract is None else extract
+        self.workers = cfg.network.concurrency
+        self.checkpoint = Path(cfg.cache.path).joinpath("checkpoint.jsonl")
+        self.counts = {"success": 0, "failed": 0, "collision": 0, "error": 0, "skipped": 0}
+        # raised by the scan thread, re-raised by run()
+        self._error = None
+        self._fetch = queue.Queue(maxsize=cfg.comm.queue_size)
+        self._organize = queue.Queue(maxsize=cfg.comm.queue_size)
+        self.planner = Planner(root, cfg)
+
+    def _handled(self) -> set:
+        if not self.checkpoint.exists():
+            return set()
+        with self.checkpoint.open(encoding="utf-8") as f:
+            return {json.loads(line)["file"] for line in f if line.strip()}
+
+    def _scan(self, scanner: Scanner, handled: set):
+        try:
+            for file in scanner:
+                if str(file) in handled:
+                    self.counts["skipped"] += 1
+                    continue
+                self._fetch.put((file, self.extract(file)))
+        except BaseException as exc:
+            self._error = exc
+        finally:
+            for _ in range(self.workers):
+                self._fetch.put(_done)
+
+    def _fetch_worker(self):
+        while (item := self._fetch.get()) is not _done:
+            file, number = item
+            data = None
+            # noinspection PyBroadException
+            try:
+                if number is not None:
+                    data = get_metadata(file, number, self.cfg)
+            except Exception as exc:
+                logging.info(f"PipelineError: {file} {exc}")
+            self._organize.put((file, number, data))
+        self._organize.put(_done)
+
+    def organize(self, file: Path, data):
+        """
+        move a file into the success folder named by the rules, or into the failed folder
+        moves are journaled by the planner and can be rolled back
+
+        Returns:
+            Path: new path, None if not moved
+
+        Raises:
+            FileExistsError: the target is taken, eg. by another part of the title
+        """
+        dest = self.planner.target(file, data)
+        if dest is None or mkdir(dest.parent) is None:
+            return
+        if dest.exists():
+            raise FileExistsError(f"{dest} exists")
+        if self.planner.move(file, dest):
+            return dest
+
+    def _organize_worker(self, out):
+        finished = 0
+        while finished < self.workers:
+            item = self._organize.get()
+            if item is _done:
+                finished += 1
+                continue
+            file, number, data = item
+            dest, state = None, "failed"
+            # noinspection PyBroadException
+            try:
+                dest = self.organize(file, data)
+                if data is not None:
+                    state = "success" if dest is not None else "error"
+            except FileExistsError as exc:
+                logging.info(f"fail to move {file}: {exc}")
+                state = "collision"
+            except Exception as exc:
+                logging.info(f"PipelineError: {file} {exc}")
+                state = "error"
+            self.counts[state] += 1
+            out.write(json.dumps({
+                "file": str(file), "number": number, "dest": None if dest is None else str(dest),
+            }, ensure_ascii=False) + "\n")
+            out.flush()
+
+    def run(self) -> dict:
+        """
+        Returns:
+            dict: count of files organized (success), not resolved (failed),
+                resolved but not moved because the target is taken (collision)
+                or because of an error (error), and skipped from a checkpoint
+
+        Raises:
+            Exception: the scan failed, the checkpoint is kept to resume from
+
+        with resource.incremental, no file is recorded in the manifest:
+        organized files leave the scanned folders, the others are tried again next run
+        and the store backs off numbers that failed
+        """
+        handled = self._handled()
+        self.checkpoint.parent.mkdir(parents=True, exist_ok=True)
+        scanner = Scanner.from_config(self.root, self.cfg, defer=True)
+        threads = [threading.Thread(target=self._scan, args=(scanner, handled), daemon=True)]
+        threads += [threading.Thread(target=self._fetch_worker, daemon=True) for _ in range(self.workers)]
+        try:
+            with self.checkpoint.open("a", encoding="utf-8") as out:
+                for thread in threads:
+                    thread.start()
+                self._organize_worker(out)
+            for thread in threads:
+                thread.join()
+        finally:
+            scanner.close()
+            self.planner.journal.close()
+            Tracer.default(self.cfg).flush()
+        if self._error is not None:
+            raise self._error
+        self.checkpoint.unlink()
+        return self.counts
@@ -0,0 +1,145 @@
+# coding: utf-8
+"""
+incremental filesystem scanner
+
+"""
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+__all__ = ["Scanner"]
+
+
+class Scanner:
+    """
+    walk a folder with os.scandir, excluded folders are pruned before descending,
+    video files are yielded as they are found
+
+    with a manifest, (path, size, mtime, inode) of every yielded file is recorded
+    and unchanged files are skipped on the next run,
+    rows are written every `batch` files and on close
+    """
+
+    batch = 1000
+
+    def __init__(self, root: Path, file_type: list, exclude_folders: list, manifest: Path = None,
+                 defer: bool = False):
+        """
+        Args:
+            root (Path): folder to scan
+            file_type (list): suffixes, eg. ".mp4"
+            exclude_folders (list): folders relative to root, or absolute
+            manifest (Path): sqlite file, scan everything if None
+            defer (bool): do not record yielded files, the caller records them with done()
+        """
+        self.root = root
+        self.defer = defer
+        self._lock = threading.Lock()
+        self.file_type = {t.lower() for t in file_type}
+        self.excluded = {os.path.normcase(str(root.joinpath(e))) for e in exclude_folders}
+        self._db = None
+        self._pending = []
+        if manifest is not None:
+            manifest.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(manifest), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS manifest ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, inode INTEGER)"
+            )
+
+    @classmethod
+    def from_config(cls, root: Path, cfg, defer: bool = False):
+        manifest = None
+        if cfg.resource.incremental:
+            manifest = Path(cfg.cache.path).joinpath("manifest.sqlite")
+        return cls(root, cfg.resource.file_type, cfg.resource.exclude_folders, manifest, defer)
+
+    def walk(self):
+        """
+        depth first walk, symlinked folders are not followed
+
+        Yields:
+            os.DirEntry: files below root, excluded folders skipped
+        """
+        stack = [str(self.root)]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if os.path.normcase(entry.path) not in self.excluded:
+                                stack.append(entry.path)
+                        elif entry.is_file():
+                            yield entry
+            except OSError:
+                continue
+
+    def changed(self, entry: os.DirEntry, stat: os.stat_result) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime, inode FROM manifest WHERE path = ?", (entry.path,)
+            ).fetchone()
+        return row != (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+    def __iter__(self):
+        try:
+            for entry in self.walk():
+                if os.path.splitext(entry.name)[1].lower() not in self.file_type:
+                    continue
+                if self._db is not None:
+                    stat = entry.stat()
+                    if not self.changed(entry, stat):
+                        continue
+                    if not self.defer:
+                        self._record((entry.path, stat.st_size, stat.st_mtime_ns, stat.st_ino))
+                yield Path(entry.path)
+        finally:
+            self.flush()
+
+    def _record(self, row: tuple):
+        with self._lock:
+            self._pending.append(row)
+            full = len(self._pending) >= self.batch
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        write the recorded rows in one transaction
+        """
+        if self._db is None:
+            return
+        with self._lock:
+            if self._pending:
+                self._db.executemany("INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?)", self._pending)
+                self._db.commit()
+                self._pending.clear()
+
+    def done(self, file: Path):
+        """
+        record a file handled by the caller, files moved away are ignored
+        """
+        if self._db is None:
+            return
+        try:
+            stat = file.stat()
+        except OSError:
+            return
+        self._record((str(file), stat.st_size, stat.st_mtime_ns, stat.st_ino))
+
+    def forget(self, file: Path):
+        """
+        drop a file from the manifest, so it is yielded again next run
+        """
+        if self._db is not None:
+            with self._lock:
+                self._pending = [row for row in self._pending if row[0] != str(file)]
+                self._db.execute("DELETE FROM manifest WHERE path = ?", (str(file),))
+                self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self.flush()
+            self._db.close()
@@ -0,0 +1,194 @@
+# coding: utf-8
+"""
+persistent number -> metadata index, consulted before any plugin runs
+
+"""
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from src.plugin.comm.metadata import Metadata
+from src.plugin.comm.registry import Registry
+
+__all__ = ["ResultStore"]
+
+
+class ResultStore:
+    """
+    resolved numbers are kept with the source plugin, its version and a timestamp,
+    an entry is dropped once older than cache.store_ttl or when the plugin version changed
+
+    numbers that failed on every plugin are remembered too,
+    they are retried after cache.failed_backoff seconds, doubled per failed attempt
+    """
+
+    # settings -> store, see default()
+    _defaults = {}
+    _lock = threading.Lock()
+
+    def __init__(self, path: Path, ttl: int = 30 * 24 * 3600, backoff: int = 3600):
+        """
+        Args:
+            path (Path): sqlite file
+            ttl (int): seconds a resolved entry stays valid
+            backoff (int): seconds before the first retry of a failed number
+        """
+        self.ttl = ttl
+        self.backoff = backoff
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS result ("
+            "number TEXT PRIMARY KEY, data TEXT, plugin TEXT, version TEXT, "
+            "updated REAL, attempts INTEGER)"
+        )
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        cache = config.cache
+        return cls(Path(cache.path).joinpath("result.sqlite"), cache.store_ttl, cache.failed_backoff)
+
+    @classmethod
+    def default(cls, config):
+        """
+        process-wide store, None if cache.enable_store is off,
+        one per distinct cache path and ttl settings
+        """
+        cache = config.cache
+        if not cache.enable_store:
+            return None
+        key = (cache.path, cache.store_ttl, cache.failed_backoff)
+        with cls._lock:
+            if key not in cls._defaults:
+                cls._defaults[key] = cls.from_config(config)
+            return cls._defaults[key]
+
+    @staticmethod
+    def _key(number: str) -> str:
+        return number.strip().upper()
+
+    def _row(self, number):
+        with self._lock:
+            return self._db.execute(
+                "SELECT data, plugin, version, updated, attempts FROM result WHERE number = ?",
+                (self._key(number),),
+            ).fetchone()
+
+    def get(self, number: str):
+        """
+        Returns:
+            Metadata: None if not resolved, expired or resolved by an outdated plugin
+        """
+        row = self._row(number)
+        if row is None or row[0] is None:
+            return
+        data, plugin, version, updated, _ = row
+        if time.time() - updated > self.ttl or version != self._version(plugin):
+            return
+        return Metadata.from_json(data)
+
+    def failed(self, number: str) -> bool:
+        """
+        Returns:
+            bool: True if the number failed everywhere and its backoff has not passed yet
+        """
+        row = self._row(number)
+        if row is None or row[0] is not None:
+            return False
+        _, _, _, updated, attempts = row
+        wait = min(self.backoff * 2 ** (attempts - 1), self.ttl)
+        return time.time() - updated < wait
+
+    def put(self, number: str, data, plugin: str):
+        """
+        record a resolved number
+        """
+        self._write(
+            self._key(number), data.to_json(), plugin,
+            self._version(plugin), time.time(), 0,
+        )
+
+    def put_failed(self, number: str):
+        """
+        record a number that no plugin could resolve
+        """
+        row = self._row(number)
+        attempts = row[4] + 1 if row is not None and row[0] is None else 1
+        self._write(self._key(number), None, None, None, time.time(), attempts)
+
+    def _write(self, *row):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO result VALUES (?, ?, ?, ?, ?, ?)", row)
+            self._db.commit()
+
+    @staticmethod
+    def _version(plugin):
+        version = Registry.version(plugin) if plugin else None
+        return None if version is None else str(version)
+
+    def invalidate(self, number: str = None, plugin: str = None, before: float = None):
+        """
+        drop entries by number, by source plugin or older than a timestamp, all if no argument
+        """
+        sql, args = "DELETE FROM result WHERE 1", []
+        if number is not None:
+            sql, args = sql + " AND number = ?", args + [self._key(number)]
+        if plugin is not None:
+            sql, args = sql + " AND plugin = ?", args + [plugin]
+        if before is not None:
+            sql, args = sql + " AND updated < ?", args + [before]
+        with self._lock:
+            self._db.execute(sql, args)
+            self._db.commit()
+
+    def export(self, file: Path) -> int:
+        """
+        write all entries as json lines
+
+        Returns:
+            int: number of entries
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT number, data, plugin, version, updated, attempts FROM result"
+            ).fetchall()
+        keys = ["number", "data", "plugin", "version", "updated", "attempts"]
+        with file.open("w", encoding="utf-8") as f:
+            for row in rows:
+                entry = dict(zip(keys, row))
+                if entry["data"] is not None:
+                    entry["data"] = json.loads(entry["data"])
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return len(rows)
+
+    def load(self, file: Path) -> int:
+        """
+        import json lines written by export, existing numbers are overwritten
+
+        Returns:
+            int: number of entries
+        """
+        rows = []
+        with file.open(encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                data = entry["data"]
+                rows.append((
+                    self._key(entry["number"]),
+                    None if data is None else json.dumps(data, ensure_ascii=False),
+                    entry["plugin"], entry["version"], entry["updated"], entry["attempts"],
+                ))
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO result VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,322 @@
+# coding: utf-8
+"""
+on-disk http response cache, stored in one sqlite file
+
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+from requests import Request, Response
+from requests.structures import CaseInsensitiveDict
+
+__all__ = ["ResponseCache", "CacheEntry", "LinkIndex"]
+
+
+class CacheEntry:
+    """
+    a stored response
+    """
+
+    __slots__ = ("key", "url", "status", "headers", "body", "stored")
+
+    def __init__(self, key, url, status, headers, body, stored):
+        self.key = key
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.stored = stored
+
+    @property
+    def validators(self) -> dict:
+        """
+        headers for a conditional request
+        """
+        headers = {}
+        if "etag" in self.headers:
+            headers["If-None-Match"] = self.headers["etag"]
+        if "last-modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["last-modified"]
+        return headers
+
+    def to_response(self) -> Response:
+        response = Response()
+        response.status_code = self.status
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.body
+        response.url = self.url
+        response.encoding = "utf-8"
+        response.from_cache = True
+        return response
+
+
+class ResponseCache:
+    """
+    content-addressed response cache, keyed by method, url and body
+
+    entries expire after cache.ttl (or cache.site_ttl per hostname),
+    expired entries with ETag/Last-Modified are revalidated instead of refetched,
+    the least recently used entries are evicted once cache.max_size bytes are exceeded
+    """
+
+    # settings -> instance, see default()
+    _defaults = {}
+    _lock = threading.Lock()
+
+    def __init__(self, path: Path, ttl: int = 86400, site_ttl: dict = None,
+                 max_size: int = 512 * 1024 * 1024, offline: bool = False):
+        """
+        Args:
+            path (Path): sqlite file
+            ttl (int): seconds a response stays fresh
+            site_ttl (dict): hostname -> ttl
+            max_size (int): bytes of bodies kept
+            offline (bool): never touch the network, serve cached responses only
+        """
+        self.ttl = ttl
+        self.site_ttl = site_ttl or {}
+        self.max_size = max_size
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS response ("
+            "key TEXT PRIMARY KEY, url TEXT, status INTEGER, headers TEXT, body BLOB, "
+            "size INTEGER, stored REAL, accessed REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS response_accessed ON response(accessed)")
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM response").fetchone()[0]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        cache = config.cache
+        return cls(
+            Path(cache.path).joinpath("http.sqlite"),
+            cache.ttl, cache.site_ttl, cache.max_size, cache.offline,
+        )
+
+    @classmethod
+    def default(cls, config):
+        """
+        process-wide cache, None if cache.enable is off,
+        one per distinct cache path, ttl, size and offline settings
+        """
+        cache = config.cache
+        if not cache.enable:
+            return None
+        key = (cache.path, cache.ttl, tuple(sorted(cache.site_ttl.items())), cache.max_size, cache.offline)
+        with cls._lock:
+            if key not in cls._defaults:
+                cls._defaults[key] = cls.from_config(config)
+            return cls._defaults[key]
+
+    @staticmethod
+    def key(method: str, url: str, **kwargs):
+        """
+        Returns:
+            str: hash key, params and data are encoded as requests would
+        """
+        prepared = Request(
+            method, url, params=kwargs.get("params"), data=kwargs.get("data")
+        ).prepare()
+        body = prepared.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+        digest = hashlib.sha256(
+            prepared.method.encode() + b"\n" + prepared.url.encode() + b"\n" + body
+        )
+        return digest.hexdigest()
+
+    def lookup(self, key: str):
+        """
+        Returns:
+            CacheEntry: None if not cached
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, status, headers, body, stored FROM response WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return
+            self._db.execute("UPDATE response SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        url, status, headers, body, stored = row
+        return CacheEntry(key, url, status, json.loads(headers), body, stored)
+
+    def fresh(self, entry: CacheEntry) -> bool:
+        ttl = self.site_ttl.get(urlparse(entry.url).hostname, self.ttl)
+        fresh = time.time() - entry.stored < ttl
+        if fresh:
+            self.hits += 1
+        return fresh
+
+    def store(self, key: str, response: Response):
+        """
+        store a successful response, evict old entries if over size
+        """
+        body = response.content
+        headers = {k.lower(): v for k, v in response.headers.items()}
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT size FROM response WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, response.url, response.status_code, json.dumps(headers), body, len(body), now, now),
+            )
+            self._size += len(body) - (old[0] if old else 0)
+            if self._size > self.max_size:
+                self._evict()
+            self._db.commit()
+
+    def refresh(self, entry: CacheEntry):
+        """
+        the server answered 304, the entry is fresh again
+        """
+        with self._lock:
+            self.revalidated += 1
+            entry.stored = time.time()
+            self._db.execute("UPDATE response SET stored = ? WHERE key = ?", (entry.stored, entry.key))
+            self._db.commit()
+
+    def _evict(self):
+        # drop least recently used entries until 90% of max size
+        target = self.max_size * 0.9
+        rows = self._db.execute("SELECT key, size FROM response ORDER BY accessed").fetchall()
+        dropped = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            dropped.append((key,))
+            self._size -= size
+        self._db.executemany("DELETE FROM response WHERE key = ?", dropped)
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM response")
+            self._db.commit()
+            self._size = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "size": self._size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class LinkIndex:
+    """
+    persistent (number, site) -> url index, eg. results of a web search
+
+    a found url stays valid for cache.link_ttl,
+    a miss is remembered for cache.failed_backoff so it is not searched again right away
+    """
+
+    # settings -> instance, see default()
+    _defaults = {}
+    _lock = threading.Lock()
+
+    def __init__(self, path: Path, ttl: int = 30 * 24 * 3600, miss_ttl: int = 3600):
+        """
+        Args:
+            path (Path): sqlite file
+            ttl (int): seconds a found url stays valid
+            miss_ttl (int): seconds a miss stays valid
+        """
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS link ("
+            "number TEXT, site TEXT, url TEXT, updated REAL, PRIMARY KEY (number, site))"
+        )
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        cache = config.cache
+        return cls(Path(cache.path).joinpath("link.sqlite"), cache.link_ttl, cache.failed_backoff)
+
+    @classmethod
+    def default(cls, config):
+        """
+        process-wide index, None if cache.enable is off,
+        one per distinct cache path and ttl settings
+        """
+        cache = config.cache
+        if not cache.enable:
+            return None
+        key = (cache.path, cache.link_ttl, cache.failed_backoff)
+        with cls._lock:
+            if key not in cls._defaults:
+                cls._defaults[key] = cls.from_config(config)
+            return cls._defaults[key]
+
+    @staticmethod
+    def _key(number: str) -> str:
+        return number.strip().upper()
+
+    def get(self, number: str, site: str):
+        """
+        Returns:
+            tuple: (known, url), url is None for a remembered miss
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, updated FROM link WHERE number = ? AND site = ?",
+                (self._key(number), site),
+            ).fetchone()
+        if row is None:
+            return False, None
+        url, updated = row
+        if time.time() - updated > (self.miss_ttl if url is None else self.ttl):
+            return False, None
+        return True, url
+
+    def put(self, number: str, site: str, url: str = None):
+        """
+        record a url, None records a miss
+        """
+        self.put_many(site, [(number, url)])
+
+    def put_many(self, site: str, links):
+        """
+        Args:
+            links (iterable): (number, url) pairs
+        """
+        now = time.time()
+        rows = [(self._key(number), site, url, now) for number, url in links]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO link VALUES (?, ?, ?, ?)", rows)
+            self._db.commit()
+
+    def clear(self, site: str = None):
+        with self._lock:
+            if site is None:
+                self._db.execute("DELETE FROM link")
+            else:
+                self._db.execute("DELETE FROM link WHERE site = ?", (site,))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
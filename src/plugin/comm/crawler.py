@@ -1,35 +1,156 @@
 # coding: utf-8
+import asyncio
+import atexit
+import functools
 import logging
 import re
-import shutil
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from http.cookiejar import LWPCookieJar
 from pathlib import Path
-from urllib.parse import parse_qs, urlparse, quote_plus
+from urllib.parse import parse_qs, urlparse, quote_plus, unquote
 from urllib.request import getproxies
 
 import requests
 from requests.adapters import HTTPAdapter, Retry
-from requests_html import HTML, HTMLSession
 
+from src.plugin.comm.cache import LinkIndex, ResponseCache
+from src.plugin.comm.download import Downloader
+from src.plugin.comm.flight import SingleFlight
+from src.plugin.comm.metadata import Metadata
+from src.plugin.comm.parser import Field, Page
+from src.plugin.comm.scheduler import Scheduler
+from src.plugin.comm.trace import Tracer
 
-class Metadata(defaultdict):
+
+class SessionPool:
     """
-    A dictionary supporting dot notation. and nested access
-    do not allow to convert existing dict object recursively
+    A long-lived session with a per-host connection pool
+    keep-alive connections are reused across requests instead of a new handshake per page,
+    one pool can be shared by any number of RequestHandler instances
     """
 
-    def __init__(self):
-        super(Metadata, self).__init__(Metadata)
+    # settings -> pool, see default()
+    _defaults = {}
+    _lock = threading.Lock()
 
-    def __getattr__(self, key):
-        try:
-            return self[key]
-        except KeyError:
-            return ""
+    def __init__(self, config):
+        # 429 and 503 are left to the scheduler, which slows the site down
+        self._status_forcelist = [413, 500, 502, 504]
+        self._total = config.network.total
+        self._backoff_factor = 1
+        self.pool_connections = config.network.pool_connections
+        # every worker of network.concurrency may hold a connection to the same host,
+        # a smaller pool discards connections and loses the keep-alive reuse
+        self.pool_maxsize = max(config.network.pool_maxsize, config.network.concurrency)
+        self._session = None
+        self._adapter = None
+        self._lock = threading.Lock()
+
+    @property
+    def retry_strategy(self) -> Retry:
+        """
+        Using Transport Adapters we can set a default timeout for all HTTP calls
+        Add a retry strategy to your HTTP client is straightforward.
+        We create a HTTPAdapter and pass our strategy to the adapter.
+        """
+        return Retry(
+            total=self._total,
+            status_forcelist=self._status_forcelist,
+            backoff_factor=self._backoff_factor,
+            respect_retry_after_header=False,
+        )
+
+    @property
+    def session(self):
+        """
+        Build the session on first use, then keep it for the lifetime of the pool
+        Often when using a third party API you want to verify that the returned response is indeed valid.
+        Requests offers the shorthand helper raise_for_status()
+        which asserts that the response HTTP status code is not a 4xx or a 5xx,
+        """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build()
+        return self._session
+
+    def _build(self):
+        # requests_html pulls in pyppeteer, imported only once a request is sent
+        from requests_html import HTMLSession
+
+        session = HTMLSession()
+        self._adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=self.retry_strategy,
+        )
+        session.mount("https://", self._adapter)
+        session.mount("http://", self._adapter)
+
+        assert_status_hook = (
+            lambda response, *args, **kwargs: response.raise_for_status()
+        )
+        # the requests library offers a 'hooks' interface
+        # where you can attach callbacks on certain parts of the request process.
+        session.hooks["response"] = [assert_status_hook]
+        return session
+
+    @property
+    def closed(self) -> bool:
+        return self._session is None
 
-    def __setattr__(self, key, value):
-        self[key] = value
+    @property
+    def stats(self) -> dict:
+        """
+        connection usage of the hosts currently held in the pool
+
+        Returns:
+            dict: host -> {"new": opened connections, "reused": requests served by a kept-alive one}
+        """
+        stats = {}
+        if self._adapter is None:
+            return stats
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = stats.setdefault(pool.host, {"new": 0, "reused": 0})
+            host["new"] += pool.num_connections
+            host["reused"] += max(pool.num_requests - pool.num_connections, 0)
+        return stats
+
+    def close(self):
+        """
+        close all pooled connections, the next request opens a new session
+        """
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._adapter = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @classmethod
+    def default(cls, config):
+        """
+        process-wide pool, used when handlers should share connections,
+        one per distinct retry and pool size settings
+        """
+        network = config.network
+        key = (network.total, network.pool_connections, network.pool_maxsize, network.concurrency)
+        with cls._lock:
+            if key not in cls._defaults:
+                cls._defaults[key] = cls(config)
+            return cls._defaults[key]
 
 
 class RequestHandler:
@@ -38,18 +159,31 @@ class RequestHandler:
     # https://findwork.dev/blog/advanced-usage-python-requests-timeouts-retries-hooks/
     """
 
-    def __init__(self, config, *args, **kwargs):
+    _throttled = {429, 503}
+
+    def __init__(self, config, *args, pool: SessionPool = None, scheduler: Scheduler = None,
+                 cache: ResponseCache = None, **kwargs):
         """
         Instantiates a new request handler object.
+
+        Args:
+            config (Config):
+            pool (SessionPool): shared connection pool, the handler owns a new one if not given
+            scheduler (Scheduler): per-site rate limit, the process-wide one if not given
+            cache (ResponseCache): response cache, the process-wide one if cache.enable
         """
-        self._status_forcelist = ["413", "429", "500", "502", "503", "504"]
-        self._total = 3
-        self._backoff_factor = 1
+        self.config = config
         self.timeout = config.network.timeout
+        # per-site delays are resolved by the scheduler from network.site_delay
         self.delay = config.network.delay
+        self.scheduler = Scheduler.default(config) if scheduler is None else scheduler
+        self.cache = ResponseCache.default(config) if cache is None else cache
+        self.tracer = Tracer.default(config)
         self.enable_proxy = config.network.enable_proxy
         self.proxy_type = config.network.proxy_type
         self.proxy_host = config.network.proxy_host
+        self._own_pool = pool is None
+        self.pool = SessionPool(config) if pool is None else pool
 
     @property
     def proxy_strategy(self):
@@ -63,67 +197,199 @@ class RequestHandler:
         return getproxies()
 
     @property
-    def retry_strategy(self) -> Retry:
+    def session(self):
+        return self.pool.session
+
+    def close(self):
         """
-        Using Transport Adapters we can set a default timeout for all HTTP calls
-        Add a retry strategy to your HTTP client is straightforward.
-        We create a HTTPAdapter and pass our strategy to the adapter.
+        release the connection pool if this handler owns it
         """
-        return Retry(
-            total=self._total,
-            status_forcelist=self._status_forcelist,
-            backoff_factor=self._backoff_factor,
-        )
+        if self._own_pool:
+            self.pool.close()
 
-    @property
-    def session(self):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, method: str, url: str, **kwargs):
         """
-        Often when using a third party API you want to verify that the returned response is indeed valid.
-        Requests offers the shorthand helper raise_for_status()
-        which asserts that the response HTTP status code is not a 4xx or a 5xx,
+        Serve the request from cache if fresh, else send it and store the response
+        expired entries are revalidated with ETag/Last-Modified,
+        in offline mode the network is never used
+
+        stream requests (downloads, HEAD checks) bypass the cache
+        but are still refused in offline mode
+
+        Returns:
+            Response: None if failed
         """
-        session = HTMLSession()
-        adapter = HTTPAdapter(max_retries=self.retry_strategy)
-        session.mount("https://", adapter)
-        session.mount("http://", adapter)
+        if self.cache is None:
+            return self.send(method, url, **kwargs)
+        if kwargs.get("stream"):
+            return None if self.cache.offline else self.send(method, url, **kwargs)
+        key = self.cache.key(method, url, **kwargs)
+        entry = self.cache.lookup(key)
+        host = urlparse(url).hostname
+        if entry is not None and (self.cache.offline or self.cache.fresh(entry)):
+            self.tracer.count("cache.hit", host)
+            return entry.to_response()
+        self.tracer.count("cache.miss", host)
+        if self.cache.offline:
+            return
+        if entry is not None and entry.validators:
+            kwargs["headers"] = {**entry.validators, **kwargs.get("headers", {})}
+        response = self.send(method, url, **kwargs)
+        if response is None:
+            return
+        if response.status_code == 304 and entry is not None:
+            self.tracer.count("cache.revalidated", host)
+            self.cache.refresh(entry)
+            return entry.to_response()
+        if response.status_code == 200:
+            self.cache.store(key, response)
+        return response
+
+    def send(self, method: str, url: str, **kwargs):
+        """
+        Send a request once the scheduler allows it
+        on 429/503 the site is slowed down and the request retried, up to network.total times
 
-        assert_status_hook = (
-            lambda response, *args, **kwargs: response.raise_for_status()
+        Returns:
+            Response: None if failed
+        """
+        host = urlparse(url).hostname
+        tracer = self.tracer
+        for attempt in range(self.config.network.total + 1):
+            wait = self.scheduler.acquire(host)
+            if wait:
+                tracer.record("throttle", wait, host)
+            start = time.perf_counter()
+            try:
+                response = self.session.request(
+                    method, url, timeout=self.timeout, proxies=self.proxy_strategy, **kwargs
+                )
+                self.scheduler.recover(host)
+                if tracer.enabled:
+                    self._trace(response, host, time.perf_counter() - start, attempt, kwargs.get("stream"))
+                return response
+            except requests.exceptions.HTTPError as exc:
+                if exc.response is None or exc.response.status_code not in self._throttled:
+                    logging.info(f"RequestError: {exc}")
+                    tracer.count("request.error", host)
+                    return
+                tracer.count("request.retry", host)
+                self.scheduler.penalize(host, exc.response.headers.get("Retry-After"))
+            except requests.exceptions.RequestException as exc:
+                logging.info(f"RequestError: {exc}")
+                tracer.count("request.error", host)
+                return
+        logging.info(f"RequestError: throttled by {host}")
+
+    def _trace(self, response, host, elapsed, attempt, stream):
+        # requests does not expose dns and connect timings,
+        # elapsed is the time until the headers were parsed, the rest is the body
+        ttfb = response.elapsed.total_seconds()
+        size = response.headers.get("Content-Length") if stream else len(response.content)
+        self.tracer.record(
+            "request", elapsed, host, method=response.request.method,
+            status=response.status_code, bytes=size, retries=attempt,
         )
-        # the requests library offers a 'hooks' interface
-        # where you can attach callbacks on certain parts of the request process.
-        session.hooks["response"] = [assert_status_hook]
-        return session
+        self.tracer.record("ttfb", ttfb, host)
+        if not stream:
+            self.tracer.record("body", max(elapsed - ttfb, 0.0), host)
 
     def get(self, url: str, **kwargs):
         """
         Returns the GET request encoded in `utf-8`.
         """
-        try:
-            response = self.session.get(
-                url, timeout=self.timeout, proxies=self.proxy_strategy, **kwargs
-            )
-            self.session.close()
+        response = self.request("GET", url, **kwargs)
+        if response is not None:
             response.encoding = "utf-8"
-            return response
-        except requests.exceptions.RequestException as exc:
-            logging.info(f"RequestError: {exc}")
+        return response
 
     def post(self, url, data, **kwargs):
         """
         Returns the POST request
         """
-        try:
-            response = self.session.post(
-                url, timeout=self.timeout, data=data, proxies=self.proxy_strategy, **kwargs,
+        return self.request("POST", url, data=data, **kwargs)
+
+
+class AsyncLimiter:
+    """
+    Run blocking calls from asyncio in worker threads
+    bounded by a global limit and a limit per key (host or plugin name)
+    """
+
+    def __init__(self, total: int, per_key: int):
+        self._total = asyncio.Semaphore(total)
+        self._per_key = per_key
+        self._keys = defaultdict(lambda: asyncio.Semaphore(self._per_key))
+        self._executor = ThreadPoolExecutor(max_workers=total)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.network.concurrency, config.network.site_concurrency)
+
+    async def run(self, key, fn, *args, **kwargs):
+        """
+        wait for a slot of key first, then a global one, so a busy site does not hold global slots
+        """
+        async with self._keys[key], self._total:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(fn, *args, **kwargs)
             )
-            self.session.close()
-            return response
-        except requests.exceptions.RequestException as exc:
-            logging.info(f"RequestError: {exc}")
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class AsyncRequestHandler:
+    """
+    asyncio version of RequestHandler
+    requests are still issued by the pooled blocking session, limited per host
+    """
+
+    def __init__(self, config, *args, pool: SessionPool = None, limiter: AsyncLimiter = None, **kwargs):
+        self.handler = RequestHandler(config, *args, pool=pool, **kwargs)
+        self._own_limiter = limiter is None
+        self.limiter = AsyncLimiter.from_config(config) if limiter is None else limiter
+
+    async def get(self, url: str, **kwargs):
+        return await self.limiter.run(urlparse(url).hostname, self.handler.get, url, **kwargs)
+
+    async def post(self, url, data, **kwargs):
+        return await self.limiter.run(urlparse(url).hostname, self.handler.post, url, data, **kwargs)
+
+    def close(self):
+        self.handler.close()
+        if self._own_limiter:
+            self.limiter.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
 
 
 class CrawlerBase(RequestHandler):
+    # bump when the parsing changes, stored results of older versions are refetched
+    version = 1
+    # field -> "query", (query, post-processor) or Field, compiled once per class
+    # Registry.get extracts them from the page returned by page()
+    selectors = {}
+    # index every id -> url pair of the search pages, later numbers skip their search
+    harvest = True
+    # (plugin, normalized id) -> detail url, shared by all plugins of the process
+    _harvested = {}
+    _harvest_lock = threading.Lock()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._selectors = {k: Field.of(v) for k, v in cls.selectors.items()}
 
     def __init__(self, number, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -140,11 +406,40 @@ class CrawlerBase(RequestHandler):
 
     def get_parser_html(self, url: str, **kwargs):
         """
-        Return the parser element
+        Return the parser element, parsed from the raw bytes
         """
         res = self.get(url, **kwargs)
         if res is not None:
-            return HTML(html=res.text)
+            with self.tracer.span("parse", type(self).__name__):
+                return Page.from_bytes(res.content)
+
+    def fetch(self):
+        """
+        body of the page declared selectors run on, usually the detail page of the number
+        override in plugins that declare selectors
+
+        Returns:
+            bytes: None if not found
+        """
+
+    def page(self):
+        """
+        Returns:
+            Page: parsed from fetch(), None if not found
+        """
+        content = self.fetch()
+        if content is not None:
+            with self.tracer.span("parse", type(self).__name__):
+                return Page.from_bytes(content)
+
+    def extract(self, page: Page) -> dict:
+        """
+        extract all declared selectors from a page
+
+        Returns:
+            dict: field -> value
+        """
+        return page.extract(self._selectors)
 
     def default_search(
             self, number, search_url, waterfall_xpath, id_xpath, url_xpath, **kwargs
@@ -152,27 +447,68 @@ class CrawlerBase(RequestHandler):
         """
         get html by default search
 
+        with harvest on, all ids of the page are indexed
+        and a number already seen on an earlier page is not searched again
         """
+        if self.harvest and (url := self.harvested(number)) is not None:
+            return url
         search_page = self.get_parser_html(search_url, **kwargs)
+        if search_page is None:
+            return
         parents = search_page.xpath(waterfall_xpath)
 
+        found, links = None, []
         for element in parents:
             num = element.xpath(id_xpath, first=True)
             if num is not None:
+                if self.harvest:
+                    url = element.xpath(url_xpath, first=True)
+                    if url is not None:
+                        links.append(("".join(filter(str.isalnum, num)), url))
+                if found is not None:
+                    continue
                 res = re.match(
                     "".join(filter(str.isalnum, number)),
                     "".join(filter(str.isalnum, num)),
                     flags=re.I,
                 )
                 if res is not None:
-                    return element.xpath(url_xpath, first=True)
+                    found = element.xpath(url_xpath, first=True)
+                    if not self.harvest:
+                        break
+        if links:
+            self._index(links)
+        return found
+
+    def harvested(self, number):
+        """
+        Returns:
+            str: detail url indexed from an earlier search page, None if unknown
+        """
+        site = type(self).__name__.lower()
+        key = "".join(filter(str.isalnum, number)).upper()
+        with self._harvest_lock:
+            url = self._harvested.get((site, key))
+        if url is None and (links := LinkIndex.default(self.config)) is not None:
+            _, url = links.get(key, site)
+            if url is not None:
+                with self._harvest_lock:
+                    self._harvested[(site, key)] = url
+        return url
+
+    def _index(self, links):
+        site = type(self).__name__.lower()
+        with self._harvest_lock:
+            for num, url in links:
+                self._harvested[(site, num.upper())] = url
+        if (index := LinkIndex.default(self.config)) is not None:
+            index.put_many(site, links)
 
     def get_outline(self, number):
         # jav321
         res = self.post("https://www.jav321.com/search", data={"sn": number})
-        if res is not None:
-            res.encoding = "utf-8"
-            html = HTML(html=res.text)
+        html = Page.from_bytes(res.content) if res is not None else None
+        if html is not None:
             outline = html.xpath(
                 '//div[@class="panel-body"]/div[@class="row"]/div[@class="col-md-12"]/text()', first=True
             )
@@ -180,8 +516,8 @@ class CrawlerBase(RequestHandler):
                 return outline
 
         # dmm
-        g = GSearch()
-        dmm_link = g.search(number, "dmm.co.jp")
+        dmm_link = GSearch.default(self.config).search(number, "dmm.co.jp")
+        res = None
         if dmm_link is not None:
             res = self.get_parser_html(dmm_link)
         else:
@@ -196,59 +532,111 @@ class CrawlerBase(RequestHandler):
         return ""
 
     def download(self, url, file_name):
-        r = self.get(url, stream=True)
-        if r.status_code == 200:
-            r.raw.decode_content = True
-
-            with open(file_name, "wb") as f:
-                shutil.copyfileobj(r.raw, f)
-            logging.info(f"sucessfully download: {file_name}")
-        logging.info(f"fail download: {file_name}")
+        """
+        download one file, see Downloader
+        """
+        return Downloader(self).download(url, Path(file_name))
 
     def download_all(self, img_url: dict, folder):
-        for name, url in img_url.items():
-            self.download(url, folder.joinpath(name + "jpg"))
+        """
+        download images concurrently, name as key, url as value
+
+        Returns:
+            DownloadReport:
+        """
+        downloader = Downloader(self, self.config.network.download_workers)
+        return downloader.run(
+            (url, folder.joinpath(name + ".jpg")) for name, url in img_url.items()
+        )
 
 
 class GSearch(RequestHandler):
     """
     mainly used to reduce the number of access to the target site,
     it should be a better way
+
+    one service per process, see default(): the cookie jar is shared and saved
+    every save_interval seconds instead of after each page,
+    found urls are kept in the link index and concurrent searches of the same
+    (number, site) are coalesced into one request
     """
 
-    def __init__(self, *args, **kwargs):
+    save_interval = 60
+    # (link index, pool) -> service, see default()
+    _defaults = {}
+    _jar = None
+    _saved = 0.0
+    _flight = SingleFlight()
+    # reentrant, the first service bootstraps the cookie while default() holds it
+    _lock = threading.RLock()
+
+    def __init__(self, *args, links=None, **kwargs):
         super().__init__(*args, **kwargs)
-        cookie = Path(__file__).parent.parent.joinpath(".google-cookie")
-        if cookie.exists():
-            self.cookie_jar = LWPCookieJar(str(cookie))
+        self.links = LinkIndex.default(self.config) if links is None else links
+        self.cookie_jar, bootstrap = self._shared_jar()
+        if bootstrap:
+            self.get_page("https://www.google.com/")
+
+    @classmethod
+    def default(cls, config, **kwargs):
+        """
+        process-wide service, on the process-wide connection pool
+        rather than the pool of the plugin that first needed it,
+        one per distinct link index and pool
+        """
+        pool = kwargs.setdefault("pool", SessionPool.default(config))
+        links = kwargs.setdefault("links", LinkIndex.default(config))
+        key = (id(links), id(pool))
+        with cls._lock:
+            if key not in cls._defaults:
+                cls._defaults[key] = cls(config, **kwargs)
+            return cls._defaults[key]
+
+    @classmethod
+    def _shared_jar(cls):
+        """
+        Returns:
+            tuple: (jar, True if no cookie was saved yet)
+        """
+        with cls._lock:
+            if cls._jar is not None:
+                return cls._jar, False
+            cookie = Path(__file__).parent.parent.joinpath(".google-cookie")
+            cls._jar = LWPCookieJar(str(cookie))
+            if cookie.exists():
+                # noinspection PyBroadException
+                try:
+                    cls._jar.load(ignore_discard=True, ignore_expires=True)
+                except Exception:
+                    pass
+            atexit.register(cls.save_cookie)
+            return cls._jar, not cookie.exists()
+
+    @classmethod
+    def save_cookie(cls):
+        with cls._lock:
+            if cls._jar is None:
+                return
             # noinspection PyBroadException
             try:
-                self.cookie_jar.load(ignore_discard=True, ignore_expires=True)
+                cls._jar.save(ignore_discard=True, ignore_expires=True)
             except Exception:
                 pass
-        else:
-            self.cookie_jar = None
-            self.get_page("https://www.google.com/")
+            cls._saved = time.monotonic()
 
     def get_page(self, url):
         """
-        load cookie, if not ,get page and save
+        send the shared cookie, keep the cookies set by the response
 
         """
-        response = self.session.get(
-            url,
-            timeout=self.timeout,
-            proxies=self.proxy_strategy,
-            cookies=self.cookie_jar,
-        )
-        response.encoding = "utf-8"
-        html = response.text
-        # noinspection PyBroadException
-        try:
-            self.cookie_jar.save(ignore_discard=True, ignore_expires=True)
-        except Exception:
-            pass
-        return html
+        response = self.get(url, cookies=self.cookie_jar)
+        if response is None:
+            return
+        for cookie in response.cookies:
+            self.cookie_jar.set_cookie(cookie)
+        if time.monotonic() - GSearch._saved > self.save_interval:
+            self.save_cookie()
+        return response.text
 
     @staticmethod
     def filter(link):
@@ -267,43 +655,69 @@ class GSearch(RequestHandler):
             ...
 
     @staticmethod
-    def extract(html, number):
-        """
-        extract url and title
-
-        """
-        html = HTML(html=html)
-        link_content = html.xpath("//a")
-        # this list needs to be maintained
-        title_xpath = ["//h3/div/text()", "//h3/span/text()"]
-        for content in link_content:
-            link = content.xpath("//@href", first=True)
-            if link is not None:
-                if re.search(
-                        "".join(filter(str.isalnum, number)),
-                        "".join(filter(str.isalnum, link)),
-                        flags=re.I,
-                ):
-                    return link
-                # else check title
-                for xpath in title_xpath:
-                    title = content.xpath(xpath, first=True)
-                    if title is None:
-                        continue
-                    if re.search(
-                            "".join(filter(str.isalnum, number)),
-                            "".join(filter(str.isalnum, title)),
-                            flags=re.I,
-                    ):
-                        return link
+    def extract(html, number, site=None):
+        """
+        extract the url of the best result
+
+        Returns:
+            str: original url, None if no result mentions the number
+        """
+        return GSearch.extract_all(html, [number], site).get(number)
+
+    @staticmethod
+    def extract_all(html, numbers, site=None) -> dict:
+        """
+        match several numbers against one results page
+
+        every link is visited once, a result scores 2 if the number is in its url,
+        1 if it is in its title and 1 more if it is on the site,
+        the first of the best scored results wins
+
+        Returns:
+            dict: number -> original url, numbers without result are left out
+        """
+        page = Page.from_bytes(html)
+        if page is None:
+            return {}
+        keys = {number: "".join(filter(str.isalnum, number)).lower() for number in numbers}
+        best = {}
+        for anchor in page.xpath("//a[@href]"):
+            link = GSearch.filter(anchor.element.get("href"))
+            if link is None:
+                continue
+            url = "".join(filter(str.isalnum, unquote(link))).lower()
+            title = anchor.xpath(".//h3", first=True)
+            title = "".join(filter(str.isalnum, title.text)).lower() if title is not None else ""
+            on_site = site is not None and urlparse(link).netloc.endswith(site)
+            for number, key in keys.items():
+                score = 2 * (key in url) + (key in title)
+                if not score:
+                    continue
+                score += on_site
+                if score > best.get(number, (0, None))[0]:
+                    best[number] = (score, link)
+        return {number: link for number, (_, link) in best.items()}
 
     def search(self, number, site):
         """
         can't use Chinese search, add hl-en
 
         """
+        if self.links is not None:
+            known, url = self.links.get(number, site)
+            if known:
+                return url
+        return self._flight.do((number.upper(), site), self._search, number, site)
+
+    def _search(self, number, site):
         query = quote_plus(number + "+site:" + site)
         html = self.get_page(
             url=f"https://google.com/search?hl=en&q={query}&safe=off"
         )
-        return self.filter(self.extract(html, number))
+        if html is None:
+            # not a miss, the page could not be loaded
+            return
+        url = self.extract(html, number, site)
+        if self.links is not None:
+            self.links.put(number, site, url)
+        return url
@@ -0,0 +1,181 @@
+# coding: utf-8
+"""
+concurrent, resumable image downloader
+
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import urlparse
+
+__all__ = ["Downloader", "DownloadReport"]
+
+
+@dataclass
+class DownloadReport:
+    downloaded: int = 0
+    skipped: int = 0
+    failed: int = 0
+    bytes: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """
+        Returns:
+            float: bytes per second
+        """
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+
+class Downloader:
+    """
+    download files with a bounded worker pool, through the handler's session and scheduler
+
+    each file is streamed into `name.part` and renamed when complete,
+    an existing `.part` is resumed with a Range request,
+    existing files are skipped if their size (or recorded ETag) still matches the server
+    """
+
+    _etag_file = ".etag.json"
+
+    def __init__(self, handler, workers: int = 4, verify: bool = True):
+        """
+        Args:
+            handler (RequestHandler):
+            workers (int): concurrent downloads
+            verify (bool): check existing files with a HEAD request, else skip them directly
+        """
+        self.handler = handler
+        self.workers = workers
+        self.verify = verify
+        self._lock = threading.Lock()
+        self._report = DownloadReport()
+
+    def _etags(self, folder: Path) -> dict:
+        # noinspection PyBroadException
+        try:
+            return json.loads(folder.joinpath(self._etag_file).read_text())
+        except Exception:
+            return {}
+
+    def _save_etag(self, dest: Path, etag: str):
+        with self._lock:
+            etags = self._etags(dest.parent)
+            etags[dest.name] = etag
+            dest.parent.joinpath(self._etag_file).write_text(json.dumps(etags))
+
+    def _up_to_date(self, url: str, dest: Path) -> bool:
+        if not dest.exists():
+            return False
+        if not self.verify:
+            return True
+        # through request() so offline mode is honoured, stream bypasses the cache
+        response = self.handler.request("HEAD", url, allow_redirects=True, stream=True)
+        if response is None:
+            # can not tell, keep what we have
+            return True
+        response.close()
+        etag = response.headers.get("ETag")
+        if etag is not None:
+            return self._etags(dest.parent).get(dest.name) == etag
+        length = response.headers.get("Content-Length")
+        return length is not None and int(length) == dest.stat().st_size
+
+    def _fetch(self, url: str, dest: Path) -> int:
+        """
+        Returns:
+            int: bytes written, -1 if failed
+        """
+        part = dest.with_name(dest.name + ".part")
+        offset = part.stat().st_size if part.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        response = self.handler.get(url, stream=True, headers=headers)
+        if response is None:
+            return self._resume_failed(url, dest, part, offset) if offset else -1
+        written = 0
+        try:
+            # server ignored the range, start over
+            mode = "ab" if response.status_code == 206 else "wb"
+            with part.open(mode) as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+                    written += len(chunk)
+        except OSError as exc:
+            logging.info(f"fail download: {dest} {exc}")
+            return -1
+        finally:
+            response.close()
+        os.replace(part, dest)
+        if response.headers.get("ETag"):
+            self._save_etag(dest, response.headers["ETag"])
+        return written
+
+    def _resume_failed(self, url: str, dest: Path, part: Path, offset: int) -> int:
+        """
+        a `.part` left complete by a crash before the rename is answered with 416,
+        rename it if the server size matches, else drop it and fetch from the start
+
+        Returns:
+            int: bytes written, -1 if failed
+        """
+        response = self.handler.request("HEAD", url, allow_redirects=True, stream=True)
+        if response is None:
+            # can not tell, keep the part for the next run
+            return -1
+        response.close()
+        length = response.headers.get("Content-Length")
+        if length is not None and int(length) == offset:
+            os.replace(part, dest)
+            if response.headers.get("ETag"):
+                self._save_etag(dest, response.headers["ETag"])
+            return 0
+        part.unlink(missing_ok=True)
+        return self._fetch(url, dest)
+
+    def download(self, url: str, dest: Path) -> bool:
+        """
+        Returns:
+            bool: True if the file is in place, downloaded or already up to date
+        """
+        if self._up_to_date(url, dest):
+            with self._lock:
+                self._report.skipped += 1
+            return True
+        span = self.handler.tracer.span("download", urlparse(url).hostname)
+        # noinspection PyBroadException
+        try:
+            with span:
+                written = self._fetch(url, dest)
+                span.set(bytes=written)
+        except Exception as exc:
+            logging.info(f"fail download: {dest} {exc}")
+            written = -1
+        with self._lock:
+            if written < 0:
+                self._report.failed += 1
+                return False
+            self._report.downloaded += 1
+            self._report.bytes += written
+        logging.info(f"sucessfully download: {dest}")
+        return True
+
+    def run(self, tasks) -> DownloadReport:
+        """
+        Args:
+            tasks (iterable): (url, dest path) pairs
+
+        Returns:
+            DownloadReport: counts of this run
+        """
+        self._report = DownloadReport()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(lambda task: self.download(*task), tasks))
+        self._report.elapsed = time.perf_counter() - start
+        return self._report
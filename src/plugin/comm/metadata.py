@@ -0,0 +1,171 @@
+# coding: utf-8
+"""
+fixed-schema metadata record
+
+"""
+import json
+
+__all__ = ["Metadata", "Extra"]
+
+
+class Extra(dict):
+    """
+    tags added from the file name, eg. leaked, part, sub
+    a dictionary supporting dot notation, missing keys read as ""
+    """
+
+    def __getattr__(self, key):
+        if key.startswith("__"):
+            raise AttributeError(key)
+        return self.get(key, "")
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+
+class Metadata:
+    """
+    metadata of one title, one slot per field
+    unset fields read as "", fields outside the schema are kept in extra,
+    extra itself is only allocated when used
+
+    also supports the mapping interface, only set fields are keys
+    """
+
+    fields = (
+        "id", "title", "original_title", "outline", "actor", "studio", "label", "series",
+        "director", "release", "year", "runtime", "genre", "tag", "cover", "fanart",
+        "poster", "extrafanart", "trailer", "website", "provenance",
+    )
+    __slots__ = fields + ("_extra",)
+    _field_set = frozenset(fields)
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def __getattr__(self, key):
+        # only called for unset slots and unknown names
+        if key.startswith("__") or key == "_extra":
+            raise AttributeError(key)
+        if key in self._field_set:
+            return ""
+        try:
+            return object.__getattribute__(self, "_extra").get(key, "")
+        except AttributeError:
+            return ""
+
+    def __setattr__(self, key, value):
+        if key in self._field_set or key in ("extra", "_extra"):
+            object.__setattr__(self, key, value)
+        else:
+            self.extra[key] = value
+
+    @property
+    def extra(self) -> Extra:
+        try:
+            return self._extra
+        except AttributeError:
+            self._extra = Extra()
+            return self._extra
+
+    @extra.setter
+    def extra(self, value):
+        self._extra = Extra(value)
+
+    def __getitem__(self, key):
+        if key == "extra":
+            return self.extra
+        if key in self._field_set:
+            try:
+                return object.__getattribute__(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        try:
+            object.__delattr__(self, "_extra" if key == "extra" else key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """
+        set fields in schema order, then extra if it has content
+        """
+        keys = [k for k in self.fields if k in self]
+        try:
+            if object.__getattribute__(self, "_extra"):
+                keys.append("extra")
+        except AttributeError:
+            pass
+        return keys
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (Metadata, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Metadata({self.to_dict()!r})"
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            self[key] = value
+
+    def to_dict(self) -> dict:
+        return {k: dict(v) if k == "extra" else v for k, v in self.items()}
+
+    @classmethod
+    def from_dict(cls, obj: dict):
+        """
+        rebuild from a plain dict, eg. loaded from json
+        """
+        data = cls()
+        for key, value in obj.items():
+            data[key] = value
+        return data
+
+    def copy(self):
+        """
+        copy with its own extra, field values are shared
+        """
+        return self.from_dict(self.to_dict())
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, text: str):
+        return cls.from_dict(json.loads(text))
@@ -0,0 +1,279 @@
+# coding: utf-8
+"""
+html parsing on lxml, pages are parsed once from raw bytes
+and selectors are compiled once, then reused for every page
+
+"""
+import importlib
+import multiprocessing
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from lxml import etree, html
+
+__all__ = ["Selector", "Field", "Page", "ParsePool", "extract_fields"]
+
+
+# a path starting the query, or a union or parenthesized member of it
+_absolute = re.compile(r"(^|[(|]\s*)//")
+
+
+@lru_cache(maxsize=1024)
+def scoped(query: str) -> str:
+    """
+    make "//" relative to the context element: ".//"
+    """
+    return _absolute.sub(r"\1.//", query)
+
+
+class Selector:
+    """
+    a compiled xpath, or a css selector translated to xpath
+    """
+
+    __slots__ = ("query", "first", "_xpath")
+
+    def __init__(self, query: str, first: bool = True, css: bool = False):
+        """
+        Args:
+            query (str): xpath, or css if css is set
+            first (bool): return the first result only
+            css (bool): query is a css selector
+        """
+        self.query = query
+        self.first = first
+        if css:
+            # cssselect is an optional dependency of lxml, only needed for css selectors
+            from cssselect import GenericTranslator
+            query = GenericTranslator().css_to_xpath(query)
+        self._xpath = etree.XPath(query)
+
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def compile(cls, query: str, first: bool = True, css: bool = False):
+        return cls(query, first, css)
+
+    def __call__(self, node, first: bool = None):
+        """
+        Returns:
+            str or Page, or a list of them; strings for text() and attribute results
+        """
+        first = self.first if first is None else first
+        results = self._xpath(node)
+        if not isinstance(results, list):
+            # string(), count() ...
+            return results
+        if first:
+            return self._convert(results[0]) if results else None
+        return [self._convert(r) for r in results]
+
+    @staticmethod
+    def _convert(result):
+        if isinstance(result, etree._Element):
+            return Page(result, sub=True)
+        return str(result)
+
+
+class Field:
+    """
+    a selector with an optional post-processor, one entry of a plugin's selectors
+
+    """
+
+    __slots__ = ("selector", "post")
+
+    def __init__(self, query: str, post=None, first: bool = True, css: bool = False):
+        """
+        Args:
+            query (str): xpath, or css if css is set
+            post (callable): applied to the selected value, eg. str.strip
+            first (bool): select the first result only
+            css (bool): query is a css selector
+        """
+        self.selector = Selector.compile(query, first, css)
+        self.post = post
+
+    @classmethod
+    def of(cls, spec):
+        """
+        build from a selectors entry: "query", (query, post) or a Field
+        """
+        if isinstance(spec, cls):
+            return spec
+        if isinstance(spec, str):
+            return cls(spec)
+        return cls(*spec)
+
+    def __call__(self, node):
+        """
+        Returns:
+            selected value, elements are reduced to their text, None if nothing selected
+        """
+        value = self.selector(node)
+        if isinstance(value, Page):
+            value = value.text
+        elif isinstance(value, list):
+            value = [v.text if isinstance(v, Page) else v for v in value]
+        if value is not None and self.post is not None:
+            value = self.post(value)
+        return value
+
+
+class Page:
+    """
+    parsed html element, with the xpath interface of requests_html
+
+    as requests_html re-parsed each element, a query on an element selected
+    from a page only searches that element: a leading "//" is read as ".//"
+    """
+
+    __slots__ = ("element", "sub")
+
+    def __init__(self, element, sub: bool = False):
+        """
+        Args:
+            element (HtmlElement):
+            sub (bool): selected from a page, queries are scoped to it
+        """
+        self.element = element
+        self.sub = sub
+
+    @classmethod
+    def from_bytes(cls, content, encoding: str = "utf-8"):
+        """
+        Args:
+            content (bytes): raw response body, str is encoded first
+
+        Returns:
+            Page: None if there is nothing to parse
+        """
+        if isinstance(content, str):
+            content = content.encode(encoding)
+        if not content or not content.strip():
+            return None
+        parser = html.HTMLParser(encoding=encoding)
+        return cls(html.fromstring(content, parser=parser))
+
+    def xpath(self, query: str, first: bool = False):
+        """
+        Args:
+            query (str): always xpath
+        """
+        if self.sub:
+            query = scoped(query)
+        return Selector.compile(query)(self.element, first)
+
+    @property
+    def text(self) -> str:
+        return self.element.text_content()
+
+    @property
+    def attrs(self) -> dict:
+        return dict(self.element.attrib)
+
+    @property
+    def html(self) -> str:
+        return etree.tostring(self.element, encoding="unicode")
+
+    def extract(self, selectors: dict) -> dict:
+        """
+        run all compiled selectors on this page
+
+        Args:
+            selectors (dict): field -> Selector or Field
+
+        Returns:
+            dict: field -> result
+        """
+        return {key: selector(self.element) for key, selector in selectors.items()}
+
+
+def extract_fields(module: str, qualname: str, content: bytes) -> dict:
+    """
+    parse a body and run the declared selectors of a plugin class,
+    top level so it can run in a worker process
+
+    Args:
+        module (str): module of the plugin class
+        qualname (str): plugin class name
+        content (bytes): page body
+
+    Returns:
+        dict: field -> (value, seconds, failed), empty if nothing to parse
+    """
+    plugin = importlib.import_module(module)
+    for name in qualname.split("."):
+        plugin = getattr(plugin, name)
+    page = Page.from_bytes(content)
+    if page is None:
+        return {}
+    results = {}
+    for key, field in plugin._selectors.items():
+        start = time.perf_counter()
+        # noinspection PyBroadException
+        try:
+            value = field(page.element)
+        except Exception:
+            value = None
+        results[key] = (value, time.perf_counter() - start, value is None)
+    return results
+
+
+class ParsePool:
+    """
+    parse pages in worker processes, so parsing does not hold the fetching threads' GIL
+    at most `backlog` bodies wait for a worker, further submits block until one is done
+    """
+
+    # (workers, backlog) -> pool, see default()
+    _defaults = {}
+    _lock = threading.Lock()
+
+    def __init__(self, workers: int, backlog: int = 64):
+        # the pool is created lazily from worker threads, forking a process
+        # while other threads hold locks (sqlite, logging, scheduler) can deadlock the child
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self._slots = threading.BoundedSemaphore(backlog)
+
+    @classmethod
+    def default(cls, config):
+        """
+        process-wide pool, None if comm.parse_workers is 0,
+        one per distinct parse_workers and parse_backlog
+        """
+        if not config.comm.parse_workers:
+            return None
+        key = (config.comm.parse_workers, config.comm.parse_backlog)
+        with cls._lock:
+            if key not in cls._defaults:
+                cls._defaults[key] = cls(*key)
+            return cls._defaults[key]
+
+    def submit(self, plugin, content: bytes):
+        """
+        Args:
+            plugin (type): plugin class with declared selectors
+            content (bytes): page body
+
+        Returns:
+            Future: of extract_fields
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(extract_fields, plugin.__module__, plugin.__qualname__, content)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def parse(self, plugin, content: bytes) -> dict:
+        return self.submit(plugin, content).result()
+
+    def close(self):
+        self._executor.shutdown()
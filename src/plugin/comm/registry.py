@@ -1,4 +1,16 @@
 # coding: utf-8
+import ast
+import asyncio
+import functools
+import importlib.util
+import logging
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from src.plugin.comm.parser import ParsePool
+from src.plugin.comm.trace import Tracer
 
 __all__ = ["Registry", "plug", "func"]
 
@@ -13,6 +25,16 @@ class Registry:
     """
     _plugins = {}
     _funcs = {}
+    # plugin name -> its own and inherited decorated methods, bound once at registration
+    _bound = {}
+    # (plugin name, field or method) -> [calls, failures, seconds]
+    _stats = defaultdict(lambda: [0, 0, 0.0])
+    _lock = threading.Lock()
+    # plugin name -> module, known without importing it, see discover()
+    # package -> manifest
+    _manifests = {}
+    _manifest_lock = threading.Lock()
+    entry_point_group = "capture.plugins"
 
     @classmethod
     def class_deco(cls, _obj):
@@ -24,8 +46,26 @@ class Registry:
 
         """
         cls._plugins[_obj.__name__] = _obj
+        cls._bound[_obj.__name__] = cls._bind(_obj)
         return _obj
 
+    @classmethod
+    def _bind(cls, _obj):
+        """
+        decorated methods of the class, matched by exact class qualname,
+        methods of base classes included unless overridden,
+        an override without @func is not run
+        """
+        methods = {}
+        for klass in reversed(_obj.__mro__):
+            for method, f in vars(klass).items():
+                name = f"{klass.__qualname__}.{method}"
+                if name in cls._funcs and cls._funcs[name] is f:
+                    methods[method] = f
+                else:
+                    methods.pop(method, None)
+        return list(methods.values())
+
     @classmethod
     def func_deco(cls, _func):
         """
@@ -42,44 +82,223 @@ class Registry:
         return _func
 
     @classmethod
-    def _register(cls, service_id: str, number, config):
+    def discover(cls, package: str = "src.plugin") -> dict:
+        """
+        find plugins without importing them: classes decorated with @plug in the
+        modules of the package, and entry points of the "capture.plugins" group
+        (name = "module:Class"), the result is kept per package for the process
+
+        Returns:
+            dict: plugin name -> module
+        """
+        with cls._manifest_lock:
+            if package in cls._manifests:
+                return cls._manifests[package]
+            manifest = {}
+            folder = Path(importlib.util.find_spec(package).origin).parent
+            for file in sorted(folder.glob("*.py")):
+                source = file.read_text(encoding="utf-8")
+                if "plug" not in source:
+                    continue
+                for name in cls._plugs(source):
+                    manifest.setdefault(name, f"{package}.{file.stem}")
+            # importlib.metadata is slow to import, only needed here
+            from importlib import metadata
+
+            try:
+                points = metadata.entry_points(group=cls.entry_point_group)
+            except TypeError:  # python < 3.10
+                points = metadata.entry_points().get(cls.entry_point_group, [])
+            for point in points:
+                manifest.setdefault(point.name, point.value.partition(":")[0])
+            cls._manifests[package] = manifest
+            return manifest
+
+    @staticmethod
+    def _plugs(source: str) -> list:
+        """
+        names of the top-level classes decorated with plug or Registry.class_deco
+        """
+        names = []
+        for node in ast.parse(source).body:
+            if not isinstance(node, ast.ClassDef):
+                continue
+            for deco in node.decorator_list:
+                if isinstance(deco, ast.Name) and deco.id == "plug" or \
+                        isinstance(deco, ast.Attribute) and deco.attr in ("plug", "class_deco"):
+                    names.append(node.name)
+        return names
+
+    @classmethod
+    def load(cls, service_id: str):
+        """
+        import the module of a discovered plugin on first use
+
+        Returns:
+            class: None if no plugin has this name
+        """
+        service = cls._plugins.get(service_id)
+        if service is None and (module := cls.discover().get(service_id)) is not None:
+            importlib.import_module(module)
+            service = cls._plugins.get(service_id)
+        return service
+
+    @classmethod
+    def names(cls) -> list:
+        """
+        Returns:
+            list: registered and discovered plugin names, nothing is imported
+        """
+        return sorted(set(cls._plugins) | set(cls.discover()))
+
+    @classmethod
+    def _register(cls, service_id: str, number, config, **kwargs):
         """
         get obj from plugin dict
         Args:
             service_id (str): obj name
+            kwargs: passed to the plugin, eg. a shared connection pool
 
         Returns: obj instance
 
         """
-        service = cls._plugins.get(service_id)
+        service = cls.load(service_id)
         if service is None:
             raise KeyError(
                 "No object named '{}' found in plugins!".format(service)
             )
-        return service(number, config)
+        return service(number, config, **kwargs)
 
     @classmethod
-    def get(cls, service_id: str, number, config):
+    def version(cls, service_id: str):
+        """
+        Returns: version attribute of the plugin, None if unknown
+
+        """
+        return getattr(cls.load(service_id), "version", None)
+
+    @classmethod
+    def get(cls, service_id: str, number, config, **kwargs):
         """
         get instance and run all decorated instance method
         Args:
             config ():
             number ():
             service_id ():
+            kwargs: passed to the plugin, eg. pool=SessionPool
 
         Returns: instance data
 
         """
-        obj = cls._register(service_id, number, config)
-        if obj is not None:
-            map(exec, [f(obj) for i, f in cls._funcs.items() if service_id in i])
+        with Tracer.default(config).span("plugin", service_id):
+            return cls._get(service_id, number, config, **kwargs)
+
+    @classmethod
+    def _get(cls, service_id: str, number, config, **kwargs):
+        obj = cls._register(service_id, number, config, **kwargs)
+        if obj is None:
+            return
+        try:
+            selectors = getattr(obj, "_selectors", None)
+            parser = ParsePool.default(config) if selectors else None
+            if parser is not None:
+                # fetch here, parse in a worker process
+                content = obj.fetch()
+                if content is not None:
+                    cls._fill_from(service_id, obj, parser.parse(type(obj), content))
+            elif selectors:
+                page = obj.page()
+                if page is not None:
+                    for key, field in selectors.items():
+                        cls._run(service_id, key, cls._fill, obj, key, field, page)
+            for f in cls._bound.get(service_id, []):
+                cls._run(service_id, f.__name__, f, obj)
             return obj.data
+        finally:
+            # releases the session pool the plugin opened if no pool was passed
+            close = getattr(obj, "close", None)
+            if close is not None:
+                close()
+
+    @staticmethod
+    def _fill(obj, key, field, page):
+        value = field(page.element)
+        if value is None:
+            return False
+        obj.data[key] = value
+
+    @classmethod
+    def _fill_from(cls, service_id, obj, results: dict):
+        """
+        fill data from extract_fields results, recording the timing measured in the worker
+        """
+        tracer = Tracer.default()
+        with cls._lock:
+            for key, (value, elapsed, failed) in results.items():
+                if value is not None:
+                    obj.data[key] = value
+                stats = cls._stats[(service_id, key)]
+                stats[0] += 1
+                stats[1] += failed
+                stats[2] += elapsed
+        for key, (_, elapsed, failed) in results.items():
+            tracer.record("field", elapsed, service_id, field=key, failed=failed)
+
+    @classmethod
+    def _run(cls, service_id, name, f, *args):
+        """
+        run one field extraction or decorated method, timed,
+        errors are logged and counted instead of interrupting the plugin
+        """
+        start = time.perf_counter()
+        # noinspection PyBroadException
+        try:
+            failed = f(*args) is False
+        except Exception as exc:
+            logging.info(f"ParseError: {service_id}.{name} {exc}")
+            failed = True
+        elapsed = time.perf_counter() - start
+        with cls._lock:
+            stats = cls._stats[(service_id, name)]
+            stats[0] += 1
+            stats[1] += failed
+            stats[2] += elapsed
+        Tracer.default().record("field", elapsed, service_id, field=name, failed=failed)
+
+    @classmethod
+    def stats(cls) -> dict:
+        """
+        Returns:
+            dict: "plugin.field" -> calls, failures and total seconds
+        """
+        with cls._lock:
+            return {
+                f"{p}.{n}": {"calls": c, "failures": f, "seconds": t}
+                for (p, n), (c, f, t) in cls._stats.items()
+            }
+
+    @classmethod
+    async def aget(cls, service_id: str, number, config, limiter=None, **kwargs):
+        """
+        async version of get, the plugin runs in a worker thread
+        Args:
+            limiter (AsyncLimiter): bounds concurrent calls, per plugin and in total
+
+        Returns: instance data
+
+        """
+        if limiter is not None:
+            return await limiter.run(service_id, cls.get, service_id, number, config, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(cls.get, service_id, number, config, **kwargs)
+        )
 
     def __repr__(self) -> list:
-        return [i for i, j in self._plugins.items()]
+        return self.names()
 
     def __contains__(self, name: str) -> bool:
-        return name in self._plugins
+        return name in self._plugins or name in self.discover()
 
     def __iter__(self):
         return iter(self._plugins.items())
@@ -0,0 +1,185 @@
+# coding: utf-8
+"""
+politeness scheduler, every request waits for a token of its host
+
+"""
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+__all__ = ["TokenBucket", "Scheduler"]
+
+
+class TokenBucket:
+    """
+    one token every `interval` seconds, at most `burst` saved up
+    waiting callers reserve a token in advance, so the order is first come first served
+    """
+
+    def __init__(self, interval: float, burst: int = 1):
+        self.base = float(interval)
+        self.interval = float(interval)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self, now: float) -> float:
+        """
+        take a token
+
+        Returns:
+            float: seconds to wait before the token is valid
+        """
+        if self.interval <= 0:
+            return max(self.blocked_until - now, 0.0)
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens * self.interval if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+
+class Scheduler:
+    """
+    token bucket per hostname, shared by every handler of the process
+
+    the interval of a host doubles on 429/503 (honoring Retry-After)
+    and decays back to its configured delay after successful requests
+    """
+
+    # settings -> scheduler, see default()
+    _defaults = {}
+    _lock = threading.Lock()
+
+    def __init__(self, delay: float = 1, overrides: dict = None, max_interval: float = 60):
+        """
+        Args:
+            delay (float): seconds between two requests to the same host
+            overrides (dict): hostname or plugin name -> delay,
+                a plugin name applies to the hosts it is a label of, eg. javbus to www.javbus.com,
+                not to other sites the plugin requests
+            max_interval (float): upper bound of the adaptive slow-down
+        """
+        self.delay = delay
+        self.overrides = overrides or {}
+        self.max_interval = max_interval
+        self._buckets = {}
+        self._metrics = defaultdict(
+            lambda: {"requests": 0, "waited": 0.0, "max_wait": 0.0, "throttled": 0}
+        )
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.network.delay, config.network.site_delay)
+
+    @classmethod
+    def default(cls, config):
+        """
+        process-wide scheduler, so all plugins respect the same per-site rate,
+        one per distinct network.delay and network.site_delay
+        """
+        network = config.network
+        key = (network.delay, tuple(sorted(network.site_delay.items())))
+        with cls._lock:
+            if key not in cls._defaults:
+                cls._defaults[key] = cls.from_config(config)
+            return cls._defaults[key]
+
+    def interval(self, host: str) -> float:
+        """
+        configured delay of a host
+        """
+        if host in self.overrides:
+            return self.overrides[host]
+        labels = set((host or "").split("."))
+        for name, delay in self.overrides.items():
+            if name in labels:
+                return delay
+        return self.delay
+
+    def _bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(self.interval(host))
+        return bucket
+
+    def acquire(self, host: str) -> float:
+        """
+        block until the host may be requested again
+
+        Args:
+            host (str): hostname
+
+        Returns:
+            float: seconds waited in the queue
+        """
+        with self._lock:
+            wait = self._bucket(host).reserve(time.monotonic())
+            metrics = self._metrics[host]
+            metrics["requests"] += 1
+            metrics["waited"] += wait
+            metrics["max_wait"] = max(metrics["max_wait"], wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def penalize(self, host: str, retry_after: str = None):
+        """
+        slow the host down after a 429/503 response
+
+        Args:
+            host (str): hostname
+            retry_after (str): value of the Retry-After header, seconds or http date
+        """
+        pause = self._parse_retry_after(retry_after)
+        with self._lock:
+            bucket = self._bucket(host)
+            bucket.interval = min(max(bucket.interval * 2, self.delay, 1), self.max_interval)
+            if pause:
+                bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + pause)
+            self._metrics[host]["throttled"] += 1
+
+    def recover(self, host: str):
+        """
+        speed the host up again after a successful request
+        """
+        with self._lock:
+            bucket = self._bucket(host)
+            if bucket.interval > bucket.base:
+                interval = bucket.interval * 0.9
+                bucket.interval = interval if interval - bucket.base > 0.05 else bucket.base
+
+    @staticmethod
+    def _parse_retry_after(value):
+        if not value:
+            return 0.0
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        # noinspection PyBroadException
+        try:
+            date = parsedate_to_datetime(value)
+            return max((date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+        except Exception:
+            return 0.0
+
+    @property
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: host -> requests, total/mean/max queue wait, throttled count and current interval
+        """
+        with self._lock:
+            stats = {}
+            for host, metrics in self._metrics.items():
+                stats[host] = dict(
+                    metrics,
+                    mean_wait=metrics["waited"] / metrics["requests"] if metrics["requests"] else 0.0,
+                    interval=self._buckets[host].interval,
+                )
+            return stats
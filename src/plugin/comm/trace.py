@@ -0,0 +1,334 @@
+# coding: utf-8
+"""
+lightweight spans and counters for the request, parse and organize stages
+
+"""
+import atexit
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+__all__ = ["Tracer", "JsonlExporter", "SummaryExporter", "PrometheusExporter"]
+
+
+class _Span:
+    """
+    times a block, extra attributes may be added with set() before it ends
+    """
+
+    __slots__ = ("tracer", "name", "site", "attrs", "start")
+
+    def __init__(self, tracer, name, site, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.site = site
+        self.attrs = attrs
+        self.start = 0.0
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.record(self.name, time.perf_counter() - self.start, self.site, **self.attrs)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class Histogram:
+    """
+    durations in fixed log-spaced buckets, memory does not grow with the samples,
+    percentiles are read from the buckets, within one bucket width (10%)
+    count, total and max are exact
+    """
+
+    __slots__ = ("count", "total", "max", "buckets")
+
+    # 100us to about 2 minutes, each bound 10% above the previous one
+    bounds = [1e-4 * 1.1 ** i for i in range(148)]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # one more for samples above the last bound
+        self.buckets = [0] * (len(self.bounds) + 1)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(self.bounds, seconds)] += 1
+
+    def percentile(self, q: float) -> float:
+        """
+        Returns:
+            float: upper bound of the bucket holding the q-th sample, at most max
+        """
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen > rank or seen == self.count:
+                bound = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(bound, self.max)
+        return self.max
+
+
+class Tracer:
+    """
+    spans are aggregated per (name, site) and handed to the exporters as they end,
+    counters count events without duration, eg. cache hits or retries
+
+    the disabled tracer returned by default() keeps no state, so instrumented
+    code only pays a method call, check enabled before computing costly attributes
+    """
+
+    enabled = True
+    _default = None
+    _lock = threading.Lock()
+
+    def __init__(self, exporters=()):
+        """
+        Args:
+            exporters (iterable): objects with span(record), flush(tracer) and close()
+        """
+        self.exporters = list(exporters)
+        # (name, site) -> Histogram
+        self._durations = defaultdict(Histogram)
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        trace = config.trace
+        exporters = []
+        if trace.jsonl:
+            exporters.append(JsonlExporter(Path(trace.jsonl)))
+        if trace.summary:
+            exporters.append(SummaryExporter())
+        if trace.prometheus:
+            exporters.append(PrometheusExporter(Path(trace.prometheus)))
+        return cls(exporters)
+
+    @classmethod
+    def default(cls, config=None):
+        """
+        process-wide tracer, created from the first config with trace.enable on,
+        the disabled tracer otherwise, exporters are flushed at exit
+        """
+        if cls._default is not None or config is None or not config.trace.enable:
+            return cls._default or NULL
+        with cls._lock:
+            if cls._default is None:
+                cls._default = cls.from_config(config)
+                atexit.register(cls._default.close)
+            return cls._default
+
+    def span(self, name: str, site: str = "", **attrs):
+        """
+        with tracer.span("parse", "javbus"): ...
+        """
+        return _Span(self, name, site, attrs)
+
+    def record(self, name: str, seconds: float, site: str = "", **attrs):
+        """
+        record a span measured by the caller
+        """
+        with self._lock:
+            self._durations[(name, site)].add(seconds)
+        if self.exporters:
+            entry = {"ts": time.time(), "name": name, "site": site, "seconds": seconds, **attrs}
+            for exporter in self.exporters:
+                exporter.span(entry)
+
+    def count(self, name: str, site: str = "", n: int = 1):
+        with self._lock:
+            self._counts[(name, site)] += n
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: (name, site) -> count, total, p50, p90, p99 and max seconds
+        """
+        with self._lock:
+            return {
+                key: {
+                    "count": h.count,
+                    "total": h.total,
+                    "p50": h.percentile(0.5),
+                    "p90": h.percentile(0.9),
+                    "p99": h.percentile(0.99),
+                    "max": h.max,
+                }
+                for key, h in sorted(self._durations.items())
+            }
+
+    def counts(self) -> dict:
+        """
+        Returns:
+            dict: (name, site) -> events
+        """
+        with self._lock:
+            return dict(sorted(self._counts.items()))
+
+    def flush(self):
+        for exporter in self.exporters:
+            exporter.flush(self)
+
+    def close(self):
+        self.flush()
+        for exporter in self.exporters:
+            exporter.close()
+
+
+class _NullTracer(Tracer):
+    enabled = False
+    _span = _NullSpan()
+
+    def __init__(self):
+        super().__init__()
+
+    def span(self, name: str, site: str = "", **attrs):
+        return self._span
+
+    def record(self, name: str, seconds: float, site: str = "", **attrs):
+        pass
+
+    def count(self, name: str, site: str = "", n: int = 1):
+        pass
+
+
+NULL = _NullTracer()
+
+
+class JsonlExporter:
+    """
+    one json line per span
+    """
+
+    def __init__(self, file: Path):
+        self.file = file
+        self._out = None
+        self._lock = threading.Lock()
+
+    def span(self, entry: dict):
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._out is None:
+                self.file.parent.mkdir(parents=True, exist_ok=True)
+                self._out = self.file.open("a", encoding="utf-8")
+            self._out.write(line)
+
+    def flush(self, tracer):
+        with self._lock:
+            if self._out is not None:
+                self._out.flush()
+
+    def close(self):
+        with self._lock:
+            if self._out is not None:
+                self._out.close()
+                self._out = None
+
+
+class SummaryExporter:
+    """
+    text table of percentiles per stage and site, written to a file or logged
+    """
+
+    def __init__(self, file: Path = None):
+        self.file = file
+
+    def span(self, entry: dict):
+        pass
+
+    @staticmethod
+    def render(tracer) -> str:
+        lines = [
+            f"{'span':<16} {'site':<20} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} "
+            f"{'p99 ms':>9} {'max ms':>9} {'total s':>9}"
+        ]
+        for (name, site), row in tracer.summary().items():
+            lines.append(
+                f"{name:<16} {site:<20} {row['count']:>7} {row['p50'] * 1000:>9.1f} "
+                f"{row['p90'] * 1000:>9.1f} {row['p99'] * 1000:>9.1f} "
+                f"{row['max'] * 1000:>9.1f} {row['total']:>9.2f}"
+            )
+        for (name, site), n in tracer.counts().items():
+            lines.append(f"{name:<16} {site:<20} {n:>7}")
+        return "\n".join(lines)
+
+    def flush(self, tracer):
+        text = self.render(tracer)
+        if self.file is None:
+            logging.info("trace summary\n" + text)
+        else:
+            self.file.write_text(text + "\n", encoding="utf-8")
+
+    def close(self):
+        pass
+
+
+class PrometheusExporter:
+    """
+    prometheus text format, for the textfile collector of node_exporter,
+    the file is replaced atomically on every flush
+    """
+
+    prefix = "capture"
+
+    def __init__(self, file: Path):
+        self.file = file
+
+    def span(self, entry: dict):
+        pass
+
+    @staticmethod
+    def _labels(**labels) -> str:
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for v in labels.values())
+        return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+    def render(self, tracer) -> str:
+        name = f"{self.prefix}_span_seconds"
+        lines = [f"# TYPE {name} summary"]
+        for (span, site), row in tracer.summary().items():
+            for q in ("p50", "p90", "p99"):
+                quantile = f"0.{q[1:]}"
+                lines.append(f"{name}{self._labels(span=span, site=site, quantile=quantile)} {row[q]}")
+            lines.append(f"{name}_sum{self._labels(span=span, site=site)} {row['total']}")
+            lines.append(f"{name}_count{self._labels(span=span, site=site)} {row['count']}")
+        name = f"{self.prefix}_events_total"
+        lines.append(f"# TYPE {name} counter")
+        for (event, site), n in tracer.counts().items():
+            lines.append(f"{name}{self._labels(event=event, site=site)} {n}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self, tracer):
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.file.with_name(self.file.name + ".tmp")
+        tmp.write_text(self.render(tracer), encoding="utf-8")
+        os.replace(tmp, self.file)
+
+    def close(self):
+        pass
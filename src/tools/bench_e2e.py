@@ -0,0 +1,384 @@
+# coding: utf-8
+"""
+offline end-to-end benchmark: search_video -> ExtractNumber -> metadata -> download -> move
+
+local servers replay fixture pages for the search, detail, outline and image endpoints,
+two stand-in plugins crawl them (bench first, mirror second in priority),
+a synthetic library of empty video files is organized
+
+python -m src.tools.bench_e2e [--engine sequential] [--files 2000] [--latency 20] [--fixtures DIR]
+
+engines, each runs the real code path:
+    sequential  get_metadata per file, plugins tried in priority order
+    race        get_metadata with comm.race = 2
+    merge       get_metadata with comm.merge on
+    async       resolve_all, files moved as they resolve
+    pipeline    Pipeline.run, no cover download and no per-file latency
+
+DIR may hold search.html, detail.html, outline.html and image.jpg,
+"{number}" and "{base}" in the pages are replaced per request, missing files are synthesized
+"""
+import argparse
+import asyncio
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urljoin, urlparse
+
+from src.core.comm import mkdir
+from src.core.config import Config
+from src.core.defaults import get_metadata, resolve_all, search_video
+from src.core.init import ExtractNumber
+from src.core.organize import Planner
+from src.core.pipeline import Pipeline
+from src.plugin.comm.crawler import CrawlerBase, RequestHandler, SessionPool
+from src.plugin.comm.download import Downloader
+from src.plugin.comm.registry import func, plug
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+SEARCH = (
+    '<html><body><div class="list">{items}</div></body></html>'
+)
+ITEM = '<div class="item"><a href="/detail/{number}"><span class="id">{number}</span></a></div>'
+DETAIL = (
+    '<html><body><h3 class="title">{number} synthetic title</h3>'
+    '<img class="cover" src="/img/{number}.jpg">'
+    '<span class="actor">actor {number}</span><span class="studio">studio</span>'
+    '<span class="release">2020-01-01</span></body></html>'
+)
+OUTLINE = '<html><body><p class="outline">outline of {number}</p></body></html>'
+
+
+class Fixtures:
+    """
+    pages served by the stand-in site
+    """
+
+    def __init__(self, folder: Path = None, image_size: int = 32 * 1024):
+        self.search = self.detail = self.outline = self.image = None
+        if folder is not None:
+            for name in ("search", "detail", "outline"):
+                file = folder.joinpath(name + ".html")
+                if file.exists():
+                    setattr(self, name, file.read_text(encoding="utf-8"))
+            if folder.joinpath("image.jpg").exists():
+                self.image = folder.joinpath("image.jpg").read_bytes()
+        self.image = self.image or random.Random(0).randbytes(image_size)
+
+    @staticmethod
+    def render(page: str, number: str, base: str) -> bytes:
+        return page.replace("{number}", number).replace("{base}", base).encode()
+
+    def search_page(self, number: str, base: str) -> bytes:
+        if self.search is not None:
+            return self.render(self.search, number, base)
+        # the number and the next titles of its series, as listing pages do
+        prefix, _, n = number.rpartition("-")
+        items = "".join(
+            ITEM.format(number=f"{prefix}-{i:03d}") for i in range(int(n), min(int(n) + 10, 1000))
+        )
+        return SEARCH.format(items=items).encode()
+
+    def detail_page(self, number: str, base: str) -> bytes:
+        return self.render(self.detail or DETAIL, number, base)
+
+    def outline_page(self, number: str, base: str) -> bytes:
+        return self.render(self.outline or OUTLINE, number, base)
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """
+    stand-in site, with latency (plus uniform jitter) and error injection
+
+    error_rate answers 500 (retried by the session), throttle_rate answers 429
+    (slows the scheduler down for the host)
+    """
+
+    daemon_threads = True
+
+    def __init__(self, fixtures: Fixtures, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def count(self, endpoint: str):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, status: int, body: bytes = b"", content_type: str = "text/html"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve(self, endpoint: str, render):
+        server = self.server
+        server.count(endpoint)
+        time.sleep(server.latency + random.uniform(0, server.jitter))
+        roll = random.random()
+        if roll < server.error_rate:
+            return self._reply(500)
+        if roll < server.error_rate + server.throttle_rate:
+            return self._reply(429)
+        body, content_type = render()
+        self._reply(200, body, content_type)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        fixtures, base = self.server.fixtures, self.server.base
+        if url.path == "/search":
+            number = parse_qs(url.query).get("q", [""])[0]
+            return self._serve("search", lambda: (fixtures.search_page(number, base), "text/html"))
+        if url.path.startswith("/detail/"):
+            number = url.path.rsplit("/", 1)[1]
+            return self._serve("detail", lambda: (fixtures.detail_page(number, base), "text/html"))
+        if url.path.startswith("/img/"):
+            return self._serve("image", lambda: (fixtures.image, "image/jpeg"))
+        self.server.count("other")
+        self._reply(404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        fixtures, base = self.server.fixtures, self.server.base
+        if urlparse(self.path).path == "/outline":
+            number = form.get("sn", [""])[0]
+            return self._serve("outline", lambda: (fixtures.outline_page(number, base), "text/html"))
+        self.server.count("other")
+        self._reply(404)
+
+    def log_message(self, *args):
+        pass
+
+
+@plug
+class Bench(CrawlerBase):
+    """
+    stand-in plugin crawling the fixture server
+    """
+
+    base = ""
+    selectors = {
+        "title": '//h3[@class="title"]/text()',
+        "cover": '//img[@class="cover"]/@src',
+        "actor": '//span[@class="actor"]/text()',
+        "studio": '//span[@class="studio"]/text()',
+        "release": '//span[@class="release"]/text()',
+    }
+
+    def fetch(self):
+        url = self.default_search(
+            self.number, f"{self.base}/search?q={self.number}",
+            '//div[@class="item"]', './/span[@class="id"]/text()', ".//a/@href",
+        )
+        if url is None:
+            return
+        res = self.get(urljoin(self.base, url))
+        if res is not None:
+            return res.content
+
+    @func
+    def id(self):
+        self.data.id = self.number
+
+    @func
+    def outline(self):
+        res = self.post(f"{self.base}/outline", data={"sn": self.number})
+        if res is not None:
+            self.data.outline = res.text
+
+
+@plug
+class Mirror(Bench):
+    """
+    second stand-in plugin, same pages from its own server
+    """
+
+    base = ""
+
+
+def library(root: Path, files: int, duplicates: float = 0.1) -> int:
+    """
+    empty video files named by number, a share of titles split in two parts
+
+    Returns:
+        int: files created
+    """
+    rng, created, i = random.Random(0), 0, 0
+    while created < files:
+        prefix = "".join(chr(65 + (i // 1000 // 26 ** j) % 26) for j in range(3))
+        number = f"{prefix}-{i % 1000:03d}"
+        folder = root.joinpath(prefix)
+        folder.mkdir(parents=True, exist_ok=True)
+        names = [f"{number}-cd1.mp4", f"{number}-cd2.mp4"] if rng.random() < duplicates else [f"{number}.mp4"]
+        for name in names[:files - created]:
+            folder.joinpath(name).touch()
+            created += 1
+        i += 1
+    return created
+
+
+ENGINES = ("sequential", "race", "merge", "async", "pipeline")
+
+
+def run(args) -> dict:
+    work = Path(tempfile.mkdtemp(prefix="bench-e2e-"))
+    fixtures = Fixtures(args.fixtures)
+    servers = {
+        "bench": FixtureServer(
+            fixtures, args.latency / 1000, args.jitter / 1000, args.error_rate, args.throttle_rate,
+        ).start(),
+        "mirror": FixtureServer(
+            fixtures, args.mirror_latency / 1000, args.jitter / 1000, args.error_rate, args.throttle_rate,
+        ).start(),
+    }
+    server = servers["bench"]
+    Bench.base = server.base
+    Mirror.base = servers["mirror"].base
+    cfg = Config()
+    cfg.comm.priority = ["bench", "mirror"]
+    cfg.comm.race = 2 if args.engine == "race" else 0
+    cfg.comm.merge = args.engine == "merge"
+    cfg.network.delay = 0
+    cfg.network.concurrency = args.workers
+    cfg.network.pool_maxsize = args.workers
+    cfg.cache.path = str(work.joinpath("cache"))
+    cfg.cache.enable = args.cache
+    root = work.joinpath("library")
+    files = library(root, args.files)
+
+    extract = ExtractNumber()
+    planner = Planner(root, cfg)
+    handler = RequestHandler(cfg, pool=SessionPool.default(cfg))
+    downloader = Downloader(handler, verify=False)
+    latencies, counts, lock = [], {"success": 0, "failed": 0, "collision": 0}, threading.Lock()
+    # targets taken by a running move, parts of one title share a target
+    claimed = set()
+
+    def place(file: Path, data):
+        dest = planner.target(file, data)
+        state = "failed" if data is None else "success"
+        if dest is not None and mkdir(dest.parent) is not None:
+            with lock:
+                taken = dest in claimed or dest.exists()
+                claimed.add(dest)
+            if taken:
+                state = "collision"
+            else:
+                if data is not None and data.cover:
+                    downloader.download(urljoin(server.base, data.cover), dest.with_name(dest.stem + "-poster.jpg"))
+                planner.move(file, dest)
+        with lock:
+            counts[state] += 1
+
+    def handle(file: Path):
+        start = time.perf_counter()
+        number = extract(file)
+        place(file, get_metadata(file, number, cfg) if number is not None else None)
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    async def resolve(executor):
+        loop, moves = asyncio.get_running_loop(), []
+        async for file, data in resolve_all(list(search_video(root, cfg)), cfg, extract):
+            moves.append(loop.run_in_executor(executor, place, file, data))
+        await asyncio.gather(*moves)
+
+    start = time.perf_counter()
+    if args.engine == "pipeline":
+        counts.update(Pipeline(root, cfg, extract).run())
+    else:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            if args.engine == "async":
+                asyncio.run(resolve(executor))
+            else:
+                list(executor.map(handle, search_video(root, cfg)))
+    elapsed = time.perf_counter() - start
+    planner.journal.close()
+    for s in servers.values():
+        s.shutdown()
+    handler.close()
+    if not args.keep:
+        shutil.rmtree(work, ignore_errors=True)
+
+    latencies.sort()
+    requests = {
+        f"{site}.{endpoint}": n for site, s in servers.items() for endpoint, n in sorted(s.requests.items())
+    }
+    return {
+        "engine": args.engine,
+        "files": files,
+        "elapsed": elapsed,
+        "files_per_sec": files / elapsed,
+        # only the per-file engines measure latency
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p99_ms": latencies[min(int(0.99 * len(latencies)), len(latencies) - 1)] * 1000 if latencies else None,
+        "requests": requests,
+        "requests_total": sum(requests.values()),
+        # kilobytes on linux, the server runs in this process too
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None,
+        **counts,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", choices=ENGINES, default="sequential", help="code path resolving the files")
+    parser.add_argument("--files", type=int, default=2000, help="files in the synthetic library")
+    parser.add_argument("--workers", type=int, default=16, help="files handled concurrently")
+    parser.add_argument("--latency", type=float, default=20.0, help="ms added to every response")
+    parser.add_argument("--mirror-latency", type=float, default=40.0, help="ms added to every mirror response")
+    parser.add_argument("--jitter", type=float, default=10.0, help="ms of uniform extra latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 500 responses")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of 429 responses")
+    parser.add_argument("--fixtures", type=Path, default=None, help="folder of recorded pages")
+    parser.add_argument("--cache", action="store_true", help="enable the response cache")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary library")
+    report = run(parser.parse_args(argv))
+    latency = "" if report["p50_ms"] is None else f"  p50 {report['p50_ms']:.1f} ms  p99 {report['p99_ms']:.1f} ms"
+    print(
+        f"{report['engine']}: {report['files']} files in {report['elapsed']:.2f} s  "
+        f"{report['files_per_sec']:.1f} files/s{latency}"
+    )
+    print(
+        f"success {report['success']}  failed {report['failed']}  collision {report['collision']}"
+        + "".join(f"  {k} {report[k]}" for k in ("error", "skipped") if report.get(k))
+    )
+    print(f"requests {report['requests_total']} {report['requests']}")
+    if report["peak_rss_mib"] is not None:
+        print(f"peak rss {report['peak_rss_mib']:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# coding: utf-8
+"""
+benchmark of GSearch.extract against the former first-match version
+
+the former version runs on Page, whose element queries are scoped like requests_html,
+so its per-link "//" queries search one link each, not the whole page
+
+python -m src.tools.bench_gsearch [links] [saved result page ...]
+without saved pages a synthetic page with the given number of links is used,
+the number searched for is in the last result
+"""
+import re
+import sys
+import time
+from pathlib import Path
+
+from src.plugin.comm.crawler import GSearch
+from src.plugin.comm.parser import Page
+
+
+def legacy_extract(html, number):
+    """
+    the former extraction, kept here as baseline
+    """
+    html = Page.from_bytes(html)
+    if html is None:
+        return
+    link_content = html.xpath("//a")
+    title_xpath = ["//h3/div/text()", "//h3/span/text()"]
+    for content in link_content:
+        link = content.xpath("//@href", first=True)
+        if link is not None:
+            if re.search(
+                    "".join(filter(str.isalnum, number)),
+                    "".join(filter(str.isalnum, link)),
+                    flags=re.I,
+            ):
+                return link
+            for xpath in title_xpath:
+                title = content.xpath(xpath, first=True)
+                if title is None:
+                    continue
+                if re.search(
+                        "".join(filter(str.isalnum, number)),
+                        "".join(filter(str.isalnum, title)),
+                        flags=re.I,
+                ):
+                    return link
+
+
+def synthetic(links: int, number: str) -> bytes:
+    results = [
+        f'<div class="g"><a href="/url?q=https://www.dmm.co.jp/cid=xyz{i:05d}/&sa=U">'
+        f"<h3><div>XYZ-{i:05d} some title</div></h3></a>"
+        f'<a href="/search?q=related+{i}">related</a></div>'
+        for i in range(links - 1)
+    ]
+    results.append(
+        f'<div class="g"><a href="/url?q=https://www.dmm.co.jp/cid={number.lower()}/&sa=U">'
+        f"<h3><div>{number} found</div></h3></a></div>"
+    )
+    return f"<html><body>{''.join(results)}</body></html>".encode()
+
+
+def measure(fn, pages, number, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for page in pages:
+            result = fn(page, number)
+    return (time.perf_counter() - start) / rounds / len(pages), result
+
+
+def main(links=200, *files):
+    number = "ABP-123"
+    pages = [Path(f).read_bytes() for f in files] or [synthetic(int(links), number)]
+    rounds = 5
+    for name, fn in (("legacy", legacy_extract), ("extract", GSearch.extract)):
+        elapsed, result = measure(fn, pages, number, rounds)
+        print(f"{name:<8} {elapsed * 1000:9.2f} ms/page  -> {result}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,70 @@
+# coding: utf-8
+"""
+memory benchmark of Metadata against the former defaultdict based class
+
+python -m src.tools.bench_metadata [records]
+"""
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+from src.plugin.comm.metadata import Metadata
+
+
+class LegacyMetadata(defaultdict):
+    """
+    the former recursive defaultdict, kept here as baseline
+    """
+
+    def __init__(self):
+        super(LegacyMetadata, self).__init__(LegacyMetadata)
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            return ""
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+
+def fill(data, i):
+    data.id = f"ABP-{i:05d}"
+    data.title = f"title {i}"
+    data.actor = "actor"
+    data.studio = "studio"
+    data.release = "2020-01-01"
+    data.runtime = "120"
+    data.genre = ["a", "b"]
+    data.cover = f"https://example.com/{i}.jpg"
+    data.outline = "outline"
+    if i % 10 == 0:
+        data.extra.leaked = "Leaked"
+    return data
+
+
+def measure(cls, records):
+    tracemalloc.start()
+    start = time.perf_counter()
+    items = [fill(cls(), i) for i in range(records)]
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return size, elapsed
+
+
+def main(records=100000):
+    records = int(records)
+    for cls in (LegacyMetadata, Metadata):
+        size, elapsed = measure(cls, records)
+        print(
+            f"{cls.__name__:<15} {size / 2 ** 20:8.1f} MiB  "
+            f"{size / records:6.0f} B/record  {elapsed:6.2f} s  ({records} records)"
+        )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
@@ -0,0 +1,69 @@
+# coding: utf-8
+"""
+micro benchmark of ExtractNumber
+
+python -m src.tools.bench_number [names.txt]
+names.txt holds one file name per line, a built-in corpus is used if not given
+"""
+import sys
+import timeit
+from pathlib import Path
+
+from src.core.init import ExtractNumber
+
+CORPUS = [
+    "ABP-454.mp4",
+    "abp454.mkv",
+    "[javbus]SSIS-001-C.mp4",
+    "hhd800.com@MIDE-993.mp4",
+    "MKBD-S120.avi",
+    "kmhrs026 1080p.mp4",
+    "FC2-PPV-1234567.mp4",
+    "FC2PPV 1234567.mp4",
+    "fc1234567.mp4",
+    "heyzo_hd_2345_full.mp4",
+    "111111-MMMM.mp4",
+    "082320-001-carib.mp4",
+    "n1234 tokyo hot.wmv",
+    "Tokyo-Hot n0987.mp4",
+    "259LUXU-1234.mp4",
+    "XXX-AV-22345.mp4",
+    "BrazzersExxtra.20.07.15.Some.Title.mp4",
+    "Blacked.21.01.02.mp4",
+    "IPX-177-cd1.mp4",
+    "IPX-177-cd2.mp4",
+    "nyap2p.com_PRED-200.mkv",
+    "22-sht.me-STARS-300.mp4",
+    "SIRO-4000 leaked.mp4",
+    "200GANA-2500.mp4",
+    "1pon-010121_001.mp4",
+    "no number at all.mp4",
+]
+
+
+def load(file=None):
+    names = CORPUS if file is None else Path(file).read_text(encoding="utf-8").splitlines()
+    return [Path(n) for n in names if n.strip()]
+
+
+def main(file=None, repeat=5):
+    paths = load(file)
+    extract = ExtractNumber()
+    stems = [p.stem for p in paths]
+
+    def cold():
+        for stem in stems:
+            ExtractNumber.extract(ExtractNumber.banned(stem))
+
+    def warm():
+        extract.batch(paths)
+
+    warm()
+    for name, fn in [("uncached", cold), ("cached", warm)]:
+        number = max(1, 20000 // len(paths))
+        best = min(timeit.repeat(fn, number=number, repeat=repeat))
+        print(f"{name:<9} {best / number / len(paths) * 1e6:8.2f} us/name  ({len(paths)} names)")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
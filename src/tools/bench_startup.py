@@ -0,0 +1,49 @@
+# coding: utf-8
+"""
+startup benchmark, each case runs in a fresh interpreter
+
+python -m src.tools.bench_startup [runs]
+"""
+import statistics
+import subprocess
+import sys
+import time
+
+CASES = {
+    "interpreter": "pass",
+    "crawler": "import src.plugin.comm.crawler",
+    "defaults": "import src.core.defaults",
+    "discover": (
+        "import src.core.defaults\n"
+        "from src.plugin.comm.registry import Registry\n"
+        "Registry.names()"
+    ),
+    # what SessionPool imports once the first request is sent
+    "requests_html": "import requests_html",
+}
+
+PROBE = "\nimport sys\nprint('requests_html' in sys.modules)"
+
+
+def measure(code: str, runs: int):
+    times, loaded = [], None
+    for _ in range(runs):
+        start = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-c", code + PROBE], capture_output=True, text=True, check=True
+        ).stdout
+        times.append(time.perf_counter() - start)
+        loaded = out.strip().endswith("True")
+    return statistics.median(times), min(times), loaded
+
+
+def main(runs=5):
+    runs = int(runs)
+    print(f"{'case':<14} {'median ms':>10} {'min ms':>8}  requests_html loaded")
+    for name, code in CASES.items():
+        median, best, loaded = measure(code, runs)
+        print(f"{name:<14} {median * 1000:10.1f} {best * 1000:8.1f}  {loaded}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])